@@ -0,0 +1,59 @@
+"""
+bench_classifier.py
+Latencia del clasificador DenseNet-121 por backend y tamaño de batch.
+
+Uso (desde backend/):
+    python -m benchmarks.bench_classifier --backends torch torchscript --batch-sizes 1 8 32
+"""
+
+import argparse
+import json
+import time
+
+import numpy as np
+
+from src.tools.execute_brain_tumor_classifier import predict_probabilities
+
+
+def bench(backend: str, batch_size: int, warmup: int, iters: int) -> dict:
+    x = np.random.rand(batch_size, 2, 128, 128).astype(np.float32)
+    for _ in range(warmup):
+        predict_probabilities(x, backend=backend)
+
+    times = []
+    for _ in range(iters):
+        t0 = time.perf_counter()
+        predict_probabilities(x, backend=backend)
+        times.append((time.perf_counter() - t0) * 1000.0)
+
+    times = np.array(times)
+    return {
+        "backend": backend,
+        "batch_size": batch_size,
+        "p50_ms": round(float(np.percentile(times, 50)), 2),
+        "p95_ms": round(float(np.percentile(times, 95)), 2),
+        "per_slice_ms": round(float(np.percentile(times, 50)) / batch_size, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--backends", nargs="+", default=["torch", "torchscript"])
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[1, 8, 32])
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--iters", type=int, default=20)
+    args = parser.parse_args()
+
+    results = [
+        bench(backend, bs, args.warmup, args.iters)
+        for backend in args.backends
+        for bs in args.batch_sizes
+    ]
+    baseline = {r["batch_size"]: r["p50_ms"] for r in results if r["backend"] == args.backends[0]}
+    for r in results:
+        r["speedup_vs_" + args.backends[0]] = round(baseline[r["batch_size"]] / r["p50_ms"], 2)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+"""
+bench_nifti_gz.py
+Lectura de un rango de slices de un `.nii.gz`: nibabel por defecto frente al
+lector con índice de acceso aleatorio (indexed_gzip) de `volume_reader`.
+
+    · nibabel get_fdata:  descomprime y decodifica el volumen completo en float64.
+    · nibabel dataobj:    slice del proxy sobre gzip estándar (descompresión secuencial).
+    · indexed (frío):     primera lectura, construye y persiste el índice.
+    · indexed (caliente): lecturas posteriores con el índice importado de disco.
+
+Uso (desde backend/):
+    python -m benchmarks.bench_nifti_gz --path data/pictures/x_flair.nii.gz --start 22 --stop 122
+    python -m benchmarks.bench_nifti_gz --synthetic   # volumen 240x240x155 int16 aleatorio
+"""
+
+import os
+import gzip
+import json
+import time
+import shutil
+import argparse
+import tempfile
+
+import numpy as np
+import nibabel as nib
+
+import src.tools.volume_reader as volume_reader
+
+
+def timed_runs(fn, iters):
+    times = []
+    for _ in range(iters):
+        t0 = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - t0) * 1000.0)
+    return round(float(np.median(times)), 2)
+
+
+def make_synthetic(directory):
+    path = os.path.join(directory, "synthetic_flair.nii.gz")
+    data = (np.random.default_rng(0).random((240, 240, 155)) * 1000).astype(np.int16)
+    nib.save(nib.Nifti1Image(data, np.eye(4)), path)
+    return path
+
+
+def reset_gz_handles():
+    """Simula un proceso nuevo: cierra los handles abiertos (el índice persistido se conserva)."""
+    with volume_reader._gz_lock:
+        for handle, _ in volume_reader._gz_handles.values():
+            handle.close()
+        volume_reader._gz_handles.clear()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--path", default=None, help="Fichero .nii.gz a leer")
+    parser.add_argument("--synthetic", action="store_true", help="Genera un volumen sintético")
+    parser.add_argument("--start", type=int, default=22)
+    parser.add_argument("--stop", type=int, default=122)
+    parser.add_argument("--iters", type=int, default=5)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_nifti_gz_")
+    volume_reader.GZ_INDEX_DIR = os.path.join(workdir, "gzindex")
+    path = make_synthetic(workdir) if args.synthetic or not args.path else args.path
+    a, b = args.start, args.stop
+
+    def gzip_dataobj():
+        with gzip.open(path, "rb") as f:
+            holder = nib.FileHolder(filename=path, fileobj=f)
+            img = nib.Nifti1Image.from_file_map({"image": holder, "header": holder})
+            np.asarray(img.dataobj[:, :, a:b], dtype=np.float32)
+
+    results = {
+        "file": path,
+        "range": [a, b],
+        "nibabel_get_fdata_ms": timed_runs(lambda: nib.load(path).get_fdata()[:, :, a:b], args.iters),
+        "nibabel_gzip_dataobj_ms": timed_runs(gzip_dataobj, args.iters),
+    }
+
+    if volume_reader.igzip is None:
+        results["indexed"] = "indexed_gzip not installed"
+    else:
+        def indexed_read():
+            volume_reader.read_slab(path, a, b, cache=False)
+
+        results["indexed_cold_ms"] = timed_runs(indexed_read, 1)
+
+        def indexed_new_process():
+            reset_gz_handles()
+            indexed_read()
+
+        results["indexed_warm_new_handle_ms"] = timed_runs(indexed_new_process, args.iters)
+        results["indexed_warm_open_handle_ms"] = timed_runs(indexed_read, args.iters)
+        results["speedup_vs_get_fdata"] = round(
+            results["nibabel_get_fdata_ms"] / results["indexed_warm_open_handle_ms"], 2)
+        reset_gz_handles()
+
+    print(json.dumps(results, indent=2))
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""
+parity_harness.py
+Paridad de precisión y latencia de los backends optimizados frente a los de referencia.
+
+Segmentación: referencia Keras (`predict_volume(..., "keras")`) contra "onnx",
+"keras-compiled" y "roi" (modo adaptativo). Se comparan las máscaras argmax con
+las métricas del propio segmentador (`dice_coef`, `dice_coef_necrotic`, ...).
+
+Clasificación: referencia PyTorch eager contra "torchscript", "onnx" y
+"onnx-int8" sobre la ventana de slices del modo volumen.
+
+Uso (desde backend/):
+    python -m benchmarks.parity_harness --pictures-dir data/pictures \\
+        --seg-backends onnx keras-compiled roi --cls-backends torchscript onnx-int8
+"""
+
+import os
+import re
+import json
+import time
+import argparse
+
+import numpy as np
+
+import src.tools.execute_brain_tumor_segmentation as seg
+import src.tools.execute_brain_tumor_classifier as cls
+from src.tools.volume_preprocessing import preprocess_volume
+from src.tools.volume_reader import read_slab
+
+SCAN_RE = re.compile(r"^(?P<scan>.+)_flair\.nii(\.gz)?$")
+
+
+def discover_scans(pictures_dir):
+    """Pares (scan_id, flair, t1ce) de un directorio con ficheros <scan>_{flair,t1ce}.nii."""
+    scans = []
+    for name in sorted(os.listdir(pictures_dir)):
+        m = SCAN_RE.match(name.lower())
+        if not m:
+            continue
+        flair = os.path.join(pictures_dir, name)
+        t1ce = os.path.join(pictures_dir, name.replace("_flair", "_t1ce"))
+        if os.path.exists(t1ce):
+            scans.append((m.group("scan"), flair, t1ce))
+    return scans
+
+
+def timed(fn, *args, **kwargs):
+    t0 = time.perf_counter()
+    out = fn(*args, **kwargs)
+    return out, (time.perf_counter() - t0) * 1000.0
+
+
+def one_hot(p):
+    return np.eye(p.shape[-1], dtype=np.float32)[p.argmax(-1)]
+
+
+# ——— Segmentación ———
+def run_segmentation_backend(X, backend):
+    if backend == "roi":
+        return seg.predict_volume_roi(X, backend="keras")
+    return seg.predict_volume(X, backend=backend)
+
+
+def segmentation_parity(X, backends):
+    seg._import_tensorflow()
+    run_segmentation_backend(X[:1], "keras")  # carga y calentamiento
+    reference, ref_ms = timed(run_segmentation_backend, X, "keras")
+    y_true = one_hot(reference)
+
+    rows = [{"backend": "keras (ref)", "latency_ms": round(ref_ms, 1)}]
+    for backend in backends:
+        run_segmentation_backend(X[:1], backend if backend != "roi" else "keras")
+        p, ms = timed(run_segmentation_backend, X, backend)
+        y_pred = one_hot(p)
+        delta = np.abs(reference - p)
+        rows.append({
+            "backend": backend,
+            "latency_ms": round(ms, 1),
+            "speedup": round(ref_ms / ms, 2),
+            "dice": round(float(seg.dice_coef(y_true[..., 1:], y_pred[..., 1:])), 4),
+            "dice_necrotic": round(float(seg.dice_coef_necrotic(y_true, y_pred)), 4),
+            "dice_edema": round(float(seg.dice_coef_edema(y_true, y_pred)), 4),
+            "dice_enhancing": round(float(seg.dice_coef_enhancing(y_true, y_pred)), 4),
+            "max_prob_delta": round(float(delta.max()), 5),
+            "mean_prob_delta": round(float(delta.mean()), 6),
+        })
+    return rows
+
+
+# ——— Clasificación ———
+def classification_parity(x, backends):
+    cls.predict_probabilities(x[:1], backend="torch")
+    reference, ref_ms = timed(cls.predict_probabilities, x, backend="torch")
+
+    rows = [{"backend": "torch (ref)", "latency_ms": round(ref_ms, 1)}]
+    for backend in backends:
+        cls.predict_probabilities(x[:1], backend=backend)
+        probs, ms = timed(cls.predict_probabilities, x, backend=backend)
+        delta = np.abs(reference - probs)
+        rows.append({
+            "backend": backend,
+            "latency_ms": round(ms, 1),
+            "speedup": round(ref_ms / ms, 2),
+            "max_prob_delta": round(float(delta.max()), 5),
+            "mean_prob_delta": round(float(delta.mean()), 6),
+            "prediction_agreement": float((reference.argmax(1) == probs.argmax(1)).mean()),
+        })
+    return rows
+
+
+def verdict(rows, min_dice, max_delta):
+    """Acepta un backend si en todos los volúmenes cumple los umbrales."""
+    by_backend = {}
+    for row in rows:
+        if "(ref)" in row["backend"]:
+            continue
+        ok = row["max_prob_delta"] <= max_delta if "dice" not in row else \
+            min(row["dice_necrotic"], row["dice_edema"], row["dice_enhancing"]) >= min_dice
+        by_backend[row["backend"]] = by_backend.get(row["backend"], True) and ok
+    return by_backend
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pictures-dir", default="data/pictures")
+    parser.add_argument("--seg-backends", nargs="*", default=["onnx", "keras-compiled", "roi"])
+    parser.add_argument("--cls-backends", nargs="*", default=["torchscript", "onnx", "onnx-int8"])
+    parser.add_argument("--min-dice", type=float, default=0.98)
+    parser.add_argument("--max-prob-delta", type=float, default=0.02)
+    parser.add_argument("--out", default=None, help="Guarda el informe JSON en esta ruta")
+    args = parser.parse_args()
+
+    report = {"segmentation": [], "classification": []}
+    for scan_id, flair_path, t1ce_path in discover_scans(args.pictures_dir):
+        flair = read_slab(flair_path)
+        t1ce = read_slab(t1ce_path)
+
+        if args.seg_backends:
+            X = preprocess_volume(flair, t1ce)
+            for row in segmentation_parity(X, args.seg_backends):
+                report["segmentation"].append({"scan_id": scan_id, **row})
+
+        if args.cls_backends:
+            indices = cls.volume_slice_indices(flair.shape[2])
+            x = cls.preprocess_slices(flair, t1ce, indices)
+            for row in classification_parity(x, args.cls_backends):
+                report["classification"].append({"scan_id": scan_id, **row})
+
+    report["accepted"] = {
+        "segmentation": verdict(report["segmentation"], args.min_dice, args.max_prob_delta),
+        "classification": verdict(report["classification"], args.min_dice, args.max_prob_delta),
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,26 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import PlainTextResponse, FileResponse
+from fastapi.responses import PlainTextResponse, FileResponse, JSONResponse, Response
 from pydantic import BaseModel
 from src.agents.orchestrator_agent import agent_orchestrator
+from src.tools.model_registry import MODEL_REGISTRY
+from src.tools.inference_scheduler import scheduler_stats
+from src.tools.inference_workers import INFERENCE_MODE, WORKERS
+from src.tools.segmentation_gate import SEGMENTATION_GATE
+from src.tools.result_cache import RESULT_CACHE
+from src.tools.volume_cache import VOLUME_CACHE
+from src.tools.tensor_store import TENSOR_STORE
+from src.tools.scan_ingestion import SCAN_INGESTION, INGESTION_ENABLED
+from src.tools.scan_catalog import SCAN_CATALOG
+from src.tools.scan_upload import StreamingNiftiUpload, UploadError
+from src.tools.volume_reader import scan_id_from_path, volume_info
+from src.tools.slice_tiles import TILE_CACHE, TILE_SIZE, TileError, render_tile
+from src.tools.mask_encoding import encode_rle, pack_mask
+from src.tools.execute_brain_tumor_segmentation import VOLUME_START_AT, segmentation_key, cached_mask
+from typing import Optional
 import logging
+import json
+import gzip
 import os
 import sys
 
@@ -46,17 +63,49 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# ================
+# ARRANQUE
+# ================
+
+@app.on_event("startup")
+def warm_models():
+    if INFERENCE_MODE == "workers":
+        # cada framework vive en su propio subproceso; la API no carga modelos
+        WORKERS.start_all()
+        logger.info("Workers de inferencia arrancados")
+        return
+    # carga los modelos una sola vez con una pasada de calentamiento
+    status = MODEL_REGISTRY.preload()
+    MODEL_REGISTRY.start_janitor()
+    logger.info(f"Precarga de modelos: {status}")
+
+@app.on_event("startup")
+def start_ingestion():
+    # pre-calcula tensores y clasificaciones de los scans nuevos en data/pictures
+    if INGESTION_ENABLED:
+        SCAN_INGESTION.start()
+
+@app.on_event("shutdown")
+def stop_workers():
+    SCAN_INGESTION.stop()
+    SCAN_CATALOG.flush()
+    if INFERENCE_MODE == "workers":
+        WORKERS.stop_all()
+
 # ================
 # ENDPOINTS
 # ================
 
 class QueryInput(BaseModel):
     query: str
+    # p_tumor mínima para segmentar un scan (None → SEGMENTATION_THRESHOLD)
+    segmentation_threshold: Optional[float] = None
 
 @app.post("/query")
 def process_query(input: QueryInput):
     try:
-        response = agent_orchestrator(input.query)
+        with SEGMENTATION_GATE.request_threshold(input.segmentation_threshold):
+            response = agent_orchestrator(input.query)
         return {"response": str(response)}
     except Exception as e:
         logger.error(f"Fallo orquestador: {e}")
@@ -74,6 +123,112 @@ async def get_progress():
         logger.error(f"Error leyendo progreso: {e}")
         return f"Error leyendo progreso: {str(e)}"
 
+@app.get("/models")
+async def get_models():
+    return MODEL_REGISTRY.stats()
+
+@app.get("/inference/stats")
+async def get_inference_stats():
+    stats = {
+        "mode": INFERENCE_MODE,
+        "schedulers": scheduler_stats(),
+        "segmentation_gate": SEGMENTATION_GATE.stats(),
+        "result_cache": RESULT_CACHE.stats(),
+        "volume_cache": VOLUME_CACHE.stats(),
+        "tensor_store": TENSOR_STORE.stats(),
+        "tile_cache": TILE_CACHE.stats(),
+    }
+    if INFERENCE_MODE == "workers":
+        stats["workers"] = WORKERS.stats()
+    return stats
+
+@app.post("/scans/upload")
+async def upload_scans(request: Request):
+    # multipart en streaming: bloques a disco + sha256 incremental, sin cargar el volumen en memoria
+    try:
+        upload = StreamingNiftiUpload(request.headers.get("content-type"))
+    except UploadError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    try:
+        async for chunk in request.stream():
+            await upload.feed(chunk)
+        files = await upload.finish()
+    except UploadError as e:
+        upload.abort()
+        logger.error(f"Subida rechazada: {e}")
+        return JSONResponse(status_code=e.status_code, content={"error": str(e), "files": upload.files})
+    except Exception as e:
+        upload.abort()
+        logger.error(f"Fallo en la subida: {e}")
+        return JSONResponse(status_code=500, content={"error": str(e), "files": upload.files})
+
+    for f in files:
+        SCAN_INGESTION.notify(f["path"])  # alta en el catálogo + ingesta en segundo plano
+    return {"files": files, "scans": sorted({scan_id_from_path(f["path"]) for f in files})}
+
+@app.get("/ingestion")
+async def get_ingestion():
+    return {"stats": SCAN_INGESTION.stats(), "scans": SCAN_INGESTION.status()}
+
+def scan_pair(scan_id: str):
+    """(flair_path, t1ce_path) del scan en data/pictures, o None."""
+    return SCAN_CATALOG.pair(scan_id)
+
+@app.get("/patients")
+def get_patients():
+    # catálogo determinista de data/pictures: paciente -> pares FLAIR/T1CE completos
+    return {"stats": SCAN_CATALOG.stats(), "patients": SCAN_CATALOG.patients()}
+
+@app.get("/patients/{patient_identifier}/scans")
+def get_patient_scans(patient_identifier: str):
+    result = SCAN_CATALOG.lookup(patient_identifier)
+    if not result["scans"]:
+        return JSONResponse(status_code=404, content=result)
+    return result
+
+@app.get("/scans/{scan_id}/tiles/{plane}/{index}")
+def get_tile(scan_id: str, plane: str, index: int, modality: str = "flair", overlay: bool = False,
+             format: str = "png", size: int = TILE_SIZE):
+    # render bajo demanda (axial/coronal/sagital) desde VOLUME_CACHE y la máscara en caché
+    pair = scan_pair(scan_id)
+    if pair is None:
+        return JSONResponse(status_code=404, content={"error": f"Scan no encontrado: {scan_id}"})
+    try:
+        data, media_type = render_tile(*pair, plane, index, modality=modality, overlay=overlay,
+                                       fmt=format, size=size)
+    except TileError as e:
+        return JSONResponse(status_code=e.status_code, content={"error": str(e)})
+    except Exception as e:
+        logger.error(f"Fallo renderizando {scan_id} {plane} {index}: {e}")
+        return JSONResponse(status_code=500, content={"error": str(e)})
+    return Response(content=data, media_type=media_type)
+
+@app.get("/scans/{scan_id}/mask")
+def get_mask(scan_id: str, request: Request, format: str = "rle"):
+    # máscara completa para overlays en el cliente: RLE (JSON) o bits empaquetados (binario)
+    if format not in ("rle", "bits"):
+        return JSONResponse(status_code=400, content={"error": "format must be 'rle' or 'bits'"})
+    pair = scan_pair(scan_id)
+    if pair is None:
+        return JSONResponse(status_code=404, content={"error": f"Scan no encontrado: {scan_id}"})
+    mask = cached_mask(segmentation_key(*pair))
+    if mask is None:
+        return JSONResponse(status_code=404, content={"error": "Scan has not been segmented yet"})
+
+    shape = volume_info(pair[0]).shape
+    if format == "rle":
+        body = json.dumps({"scan_id": scan_id, **encode_rle(mask, VOLUME_START_AT, volume_shape=shape)},
+                          separators=(",", ":")).encode("utf-8")
+        media_type = "application/json"
+    else:
+        body = pack_mask(mask, VOLUME_START_AT, volume_shape=shape)
+        media_type = "application/octet-stream"
+    headers = {}
+    if "gzip" in request.headers.get("accept-encoding", ""):
+        body = gzip.compress(body, compresslevel=6)
+        headers["Content-Encoding"] = "gzip"
+    return Response(content=body, media_type=media_type, headers=headers)
+
 @app.get("/download/{filename}")
 async def download_report(filename: str):
     file_path = os.path.join("backend", "data", "reportes", filename)
@@ -5,7 +5,7 @@ import logging
 
 from src.config.config import strands_model_4_1
 from src.config.prompts import clasificacion_system_prompt
-from src.tools.execute_brain_tumor_classifier import classify_tumor_from_image
+from src.tools.execute_brain_tumor_classifier import classify_tumor_from_image, classify_tumor_batch
 from src.tools.file_system_tools import read_file_from_local, write_file_to_local
 
 # reutilizamos logger ya configurado en main
@@ -21,6 +21,7 @@ def clasificacion_agent(input_file: str = "data/temp/lister.json") -> str:
         input_file (str): Ruta al archivo JSON de entrada con la lista de escaneos.
     
     Tools:
+        - classify_tumor_batch(input_file: str) -> str
         - classify_tumor_from_image(flair_path: str, t1ce_path: str) -> str
         - read_file_from_local(path: str, encoding: str = "utf-8") -> str
         - write_file_to_local(path: str, content: str) -> str
@@ -32,6 +33,7 @@ def clasificacion_agent(input_file: str = "data/temp/lister.json") -> str:
         classifier_agent = Agent(
             model=strands_model_4_1,
             tools=[
+                classify_tumor_batch,
                 classify_tumor_from_image,
                 read_file_from_local,
                 write_file_to_local,
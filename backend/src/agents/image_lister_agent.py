@@ -1,10 +1,8 @@
-from strands import Agent
 from strands.tools import tool
 import json
 import logging
-from src.config.config import strands_model_4_1
-from src.config.prompts import image_lister_system_prompt
-from src.tools.file_system_tools import list_files_in_dir, write_file_to_local
+from src.tools.scan_catalog import SCAN_CATALOG, LISTER_OUTPUT
+from src.tools.scan_batch import write_json
 
 # inicializar logger
 logger = logging.getLogger(__name__)
@@ -12,39 +10,33 @@ logger = logging.getLogger(__name__)
 @tool()
 def image_lister_agent(patient_identifier: str) -> str:
     """
-    Este agente actúa como un agente para listar las imágenes de un paciente.
-    Toma un identificador de paciente y devuelve una cadena JSON con las rutas de las imágenes encontradas.
-    
+    Lista las imágenes de un paciente.
+    Toma un identificador de paciente y devuelve una cadena JSON con los pares
+    FLAIR/T1CE encontrados en data/pictures/, que también guarda en data/temp/lister.json.
+
+    La búsqueda es determinista: consulta el catálogo de scans (ver scan_catalog.py),
+    que parsea los nombres `<paciente>_<n>_{flair,t1ce}.nii(.gz)`, sin llamar a un LLM.
+
     Args:
         patient_identifier (str): Identificador de paciente en formato "Nombre_Apellido1_Apellido2"
-    
-    Tools: 
-        - list_files_in_dir(path="data/pictures/"): Lista los archivos en el directorio especificado.
-        - write_file_to_local(path="data/temp/lister.json", content=json_string): Escribe la cadena JSON en un archivo local.
-        
+            (pueden faltar apellidos si solo hay un paciente que coincida).
+
     Returns:
-        str: Cadena JSON que contiene el identificador de paciente y la lista de rutas de las imágenes o un error
+        str: Cadena JSON con `patient_identifier` y la lista `scans`, o un error
     """
     try:
-        lister_agent = Agent(
-            model=strands_model_4_1,
-            tools=[
-                list_files_in_dir,
-                write_file_to_local,
-            ],
-            system_prompt=image_lister_system_prompt
-        )
-        result = lister_agent(patient_identifier)
+        result = SCAN_CATALOG.lookup(patient_identifier)
+        write_json(LISTER_OUTPUT, result)
 
         # resumen humano al progreso.txt
-        logger.info(f"🖼️ Resumen (ImageLister): imágenes listadas para {patient_identifier}. Resultado crudo: {result}")
+        logger.info(f"🖼️ Resumen (ImageLister): {len(result['scans'])} scan(s) para {patient_identifier}.")
 
-        return result
+        return json.dumps(result)
 
     except Exception as e:
         logger.error(f"❌ Resumen (ImageLister): fallo listando imágenes para {patient_identifier} - {str(e)}")
         return json.dumps({
             "patient_identifier": patient_identifier,
-            "pictures": [],
+            "scans": [],
             "error": str(e)
         })
@@ -14,6 +14,7 @@ from src.agents.rag_agent import rag_agent
 from src.agents.triage_agent import triage_agent
 from src.agents.report_agent import report_agent
 from src.agents.report_validator_agent import report_validator_agent
+from src.tools.request_context import propagate_context
 
 import uuid
 
@@ -39,6 +40,8 @@ try:
             ]
     }
     )
+    # el umbral de segmentación de /query (ContextVar) debe llegar a las herramientas
+    propagate_context(agent_orchestrator)
 
 except Exception as e:
     print(f"Error initializing AgentOrchestrator: {e}")
@@ -5,8 +5,9 @@ import logging
 
 from src.config.config import strands_model_4_1
 from src.config.prompts import segmentator_system_prompt
-from src.tools.execute_brain_tumor_segmentation import segmenter_tumor_from_image
+from src.tools.execute_brain_tumor_segmentation import segmenter_tumor_from_image, segmenter_tumor_batch
 from src.tools.file_system_tools import read_file_from_local, write_file_to_local
+from src.tools.request_context import propagate_context
 
 # logger ya configurado en main
 logger = logging.getLogger(__name__)
@@ -15,19 +16,22 @@ logger = logging.getLogger(__name__)
 def segmentator_agent(input_file: str = "data/temp/lister.json") -> str:
     """
     El LLM leerá `data/temp/lister.json`, recorrerá la lista `scans`.
-    y llamará a `segmenter_tumor_from_image` para cada par FLAIR+T1CE.
+    y llamará a `segmenter_tumor_batch` (o `segmenter_tumor_from_image` para
+    un par suelto) para segmentar los pares FLAIR+T1CE.
     argumentos de entrada data/temp/lister.json
     """
     try:
         seg_agent = Agent(
             model=strands_model_4_1,
             tools=[
+                segmenter_tumor_batch,
                 segmenter_tumor_from_image,
                 read_file_from_local,
                 write_file_to_local,
             ],
             system_prompt=segmentator_system_prompt
         )
+        propagate_context(seg_agent)  # umbral de segmentación de la petición
         result = seg_agent(input_file)
 
         # resumen human-readable
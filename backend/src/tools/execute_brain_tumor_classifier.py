@@ -1,41 +1,94 @@
 import os
 import json
 import logging
-import re
-from PIL import Image
-import cv2, numpy as np
-import nibabel as nib
-import torch
-import torch.nn as nn
-from torchvision import models, transforms
+import numpy as np
 
 from strands.tools import tool
 
+from src.tools.model_registry import MODEL_REGISTRY
+from src.tools.volume_preprocessing import preprocess_slices as preprocess_stack, slices_from_tensor
+from src.tools.inference_scheduler import MicroBatchScheduler
+from src.tools.inference_workers import INFERENCE_MODE, WORKERS
+from src.tools.result_cache import RESULT_CACHE, model_version, pair_key
+from src.tools.scan_batch import read_scans, run_per_scan, write_json
+from src.tools.volume_reader import open_image, read_slice, read_slices
+from src.tools.tensor_store import TENSOR_STORE
+from src.tools.onnx_runtime_backend import (
+    CLASSIFIER_ONNX_PATH, CLASSIFIER_ONNX_INT8_PATH,
+    create_session, run_session, softmax, warmup_classifier_session,
+)
+
 # ——— Configuración básica ———
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-DEVICE        = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 CLASS_NAMES   = ["No tumor", "Tumor"]
 MODEL_PATH    = "data/models/brain_tumor_classifier_v3.pkl"
 
+# ——— Backend de inferencia ———
+# "torch" (eager), "torchscript" (congelado, channels_last, inference_mode),
+# "onnx" (onnxruntime fp32) u "onnx-int8" (cuantizado dinámico)
+CLASSIFIER_BACKEND = os.getenv("CLASSIFIER_BACKEND", "torch")
+TORCH_THREADS      = int(os.getenv("CLASSIFIER_TORCH_THREADS", "0"))  # 0 → valor por defecto de torch
+ONNX_MODELS = {
+    "onnx":      ("classifier_onnx", CLASSIFIER_ONNX_PATH),
+    "onnx-int8": ("classifier_onnx_int8", CLASSIFIER_ONNX_INT8_PATH),
+}
+
+# ——— Modos de clasificación ———
+SLICE_IDX          = 82           # slice fijo del modo "slice"
+VOLUME_SLICE_START = 22           # ventana axial [start, end) del modo "volume"
+VOLUME_SLICE_END   = 122
+VOLUME_STRIDE      = int(os.getenv("CLASSIFIER_VOLUME_STRIDE", "4"))
+# agregación del modo "volume": media de los VOLUME_TOPK slices más probables.
+# La media de toda la ventana diluye los tumores focales que solo aparecen en
+# unos pocos slices, y esta puntuación alimenta la puerta de segmentación y la
+# ingesta; el máximo tampoco es buena opción porque un único slice ruidoso
+# basta para disparar el umbral. topk se queda con la señal focal y lo suaviza.
+VOLUME_AGGREGATION = os.getenv("CLASSIFIER_VOLUME_AGGREGATION", "topk")  # topk | max | mean
+VOLUME_TOPK        = int(os.getenv("CLASSIFIER_VOLUME_TOPK", "3"))
+
+# ——— Micro-batching entre peticiones ———
+BATCH_MAX_SIZE     = int(os.getenv("CLASSIFIER_BATCH_MAX_SIZE", "64"))
+BATCH_MAX_WAIT_MS  = float(os.getenv("CLASSIFIER_BATCH_MAX_WAIT_MS", "5"))
+
+
+# PyTorch solo se importa en el proceso que ejecuta el modelo (backends "torch" y
+# "torchscript" en proceso, o el worker del clasificador): la API trabaja con ndarrays
+torch = None
+
+def _import_torch():
+    global torch
+    if torch is None:
+        import torch as _torch
+        torch = _torch
+    return torch
+
+
+def _device():
+    _import_torch()
+    return torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
 
 # ——— Función de carga del modelo ———
 def load_model(model_path: str):
     if not os.path.exists(model_path):
         raise FileNotFoundError(f"Model file not found at {model_path}")
 
+    _import_torch()
+    from torchvision import models
+    device = _device()
     # Para evitar el error "weights only load failed":
     checkpoint = torch.load(
         model_path,
-        map_location=DEVICE,
+        map_location=device,
         weights_only=False  # Asegúrate de que esto sea False si guardaste el modelo completo
     )
 
     # Si el checkpoint es el modelo completo, devuélvelo directamente
     if not isinstance(checkpoint, dict):
         model = checkpoint
-        model.to(DEVICE)
+        model.to(device)
         model.eval()
         logger.info(f"Model loaded successfully (as full model object) from {model_path}")
         return model
@@ -43,7 +96,7 @@ def load_model(model_path: str):
     # Si es un diccionario, intenta cargar el state_dict
     # Creamos la arquitectura base primero
     model = models.densenet121(weights=None) # O la arquitectura que corresponda
-    model.classifier = nn.Linear(model.classifier.in_features, len(CLASS_NAMES))
+    model.classifier = torch.nn.Linear(model.classifier.in_features, len(CLASS_NAMES))
 
 
     if "model_state" in checkpoint:
@@ -58,45 +111,237 @@ def load_model(model_path: str):
             logger.error(f"Failed to load state_dict directly from checkpoint dictionary: {e}")
             raise ValueError(f"Checkpoint dictionary at {model_path} does not contain expected keys ('model_state' or 'state_dict') and is not a direct state_dict.")
 
-    model.to(DEVICE)
+    model.to(device)
     model.eval()
     logger.info(f"Model state_dict loaded successfully from {model_path}")
     return model
 
+def warmup_model(model):
+    """Una pasada en vacío para inicializar kernels y reservas de memoria."""
+    device = _device()
+    with torch.no_grad():
+        model(torch.zeros(1, 2, 128, 128, device=device))
+
+
+def load_torchscript_model(model_path: str):
+    """
+    Motor optimizado para CPU: DenseNet-121 trazado con TorchScript, congelado
+    (pesos como constantes, BN fusionada) y en formato channels_last.
+    """
+    _import_torch()
+    if TORCH_THREADS > 0:
+        # el presupuesto de hilos intra-op de torch es global al proceso
+        torch.set_num_threads(TORCH_THREADS)
+    model = load_model(model_path).to("cpu").eval()
+    model = model.to(memory_format=torch.channels_last)
+    example = torch.zeros(1, 2, 128, 128).contiguous(memory_format=torch.channels_last)
+    with torch.no_grad():
+        traced = torch.jit.trace(model, example)
+    scripted = torch.jit.optimize_for_inference(torch.jit.freeze(traced))
+    logger.info(f"TorchScript classifier ready (threads={torch.get_num_threads()})")
+    return scripted
+
+
+def warmup_torchscript_model(model):
+    # TorchScript especializa el grafo en las primeras ejecuciones
+    _import_torch()
+    x = torch.zeros(1, 2, 128, 128).contiguous(memory_format=torch.channels_last)
+    with torch.inference_mode():
+        for _ in range(2):
+            model(x)
+
+
+# solo se precarga el modelo del backend activo
+MODEL_REGISTRY.register("classifier", load_model, default_paths=(MODEL_PATH,), warmup=warmup_model,
+                        preload=CLASSIFIER_BACKEND == "torch")
+MODEL_REGISTRY.register("classifier_torchscript", load_torchscript_model, default_paths=(MODEL_PATH,),
+                        warmup=warmup_torchscript_model,
+                        size_fn=lambda _model: os.path.getsize(MODEL_PATH),
+                        preload=CLASSIFIER_BACKEND == "torchscript")
+for _backend, (_kind, _onnx_path) in ONNX_MODELS.items():
+    MODEL_REGISTRY.register(_kind, create_session, default_paths=(_onnx_path,),
+                            warmup=warmup_classifier_session, preload=CLASSIFIER_BACKEND == _backend)
+
 def preprocess_slice(flair_slice, t1ce_slice=None):
     """
     Recibe dos arrays 2-D (192×192, 240×240, …) y devuelve
-    un tensor (2,128,128) en rango 0-1 listo para el modelo.
+    un array float32 (2,128,128) en rango 0-1 listo para el modelo.
 
     · Si t1ce_slice es None, duplica flair → 2 canales.
     """
-    # --- resize a 128×128 ---
-    flair128 = cv2.resize(flair_slice, (128, 128),
-                          interpolation=cv2.INTER_LINEAR).astype(np.float32)
-    flair128 /= flair128.max() if flair128.max() > 0 else 1.  # 0-1
+    t1ce = None if t1ce_slice is None else t1ce_slice[:, :, None]
+    return preprocess_stack(flair_slice[:, :, None], t1ce, [0])[0]   # (2,128,128)
 
-    if t1ce_slice is None:
-        t1ce128 = flair128.copy()            # duplicar canal
-    else:
-        t1ce128 = cv2.resize(t1ce_slice, (128, 128),
-                             interpolation=cv2.INTER_LINEAR).astype(np.float32)
-        t1ce128 /= t1ce128.max() if t1ce128.max() > 0 else 1.
 
-    x = np.stack([flair128, t1ce128], axis=0)    # (2,128,128)
-    return torch.from_numpy(x).float()           # tensor
+def preprocess_slices(flair_vol, t1ce_vol, indices):
+    """
+    Pre-procesa varios slices axiales de un volumen en un único array
+    (N,2,128,128) para hacer una sola pasada batched por el modelo.
+    """
+    return preprocess_stack(flair_vol, t1ce_vol, indices)
+
+
+def volume_slice_indices(depth, start=None, end=None, stride=None):
+    """Índices axiales de la ventana [start, end) con paso `stride`, recortados al volumen."""
+    start  = VOLUME_SLICE_START if start is None else start
+    end    = VOLUME_SLICE_END if end is None else end
+    stride = VOLUME_STRIDE if stride is None else stride
+    start, end = max(0, start), min(depth, end)
+    if start >= end:
+        raise ValueError(f"Empty slice window [{start}, {end}) for a volume of depth {depth}")
+    return list(range(start, end, max(1, stride)))
+
+
+def aggregate_probabilities(p_tumor, method=VOLUME_AGGREGATION):
+    """Combina las probabilidades por slice en una puntuación de volumen."""
+    p_tumor = np.asarray(p_tumor, dtype=np.float64)
+    if method == "max":
+        return float(p_tumor.max())
+    if method == "topk":
+        k = min(VOLUME_TOPK, p_tumor.size)
+        return float(np.sort(p_tumor)[-k:].mean())
+    if method == "mean":
+        return float(p_tumor.mean())
+    raise ValueError(f"Unknown aggregation method: {method}")
+
+
+def predict_probabilities(x, backend=None):
+    """Inferencia batched: array (N,2,128,128) → array (N, n_clases) de probabilidades."""
+    backend = backend or CLASSIFIER_BACKEND
+    if backend in ONNX_MODELS:
+        session = MODEL_REGISTRY.get(ONNX_MODELS[backend][0])
+        return softmax(run_session(session, x))
+
+    _import_torch()
+    x = torch.from_numpy(np.ascontiguousarray(x, dtype=np.float32))
+    if backend == "torchscript":
+        model = MODEL_REGISTRY.get("classifier_torchscript", MODEL_PATH)
+        with torch.inference_mode():
+            x = x.cpu().contiguous(memory_format=torch.channels_last)
+            return torch.softmax(model(x), dim=1).numpy()
+
+    model = MODEL_REGISTRY.get("classifier", MODEL_PATH)
+    with torch.no_grad():
+        return torch.softmax(model(x.to(_device())), dim=1).cpu().numpy()
+
+
+def predict_probabilities_array(x):
+    """Punto de entrada del worker de inferencia (ver inference_workers.py)."""
+    return predict_probabilities(x)
+
+
+def _run_batch(x):
+    # con INFERENCE_MODE=workers la pasada se hace en el subproceso de PyTorch
+    if INFERENCE_MODE == "workers":
+        return WORKERS.run("classifier", x)
+    return predict_probabilities(x)
+
+
+CLASSIFIER_SCHEDULER = MicroBatchScheduler(
+    "classifier", _run_batch,
+    max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS,
+)
+
+
+def classify_scan(flair_path, t1ce_path, mode="slice",
+                  slice_start=None, slice_end=None, stride=None):
+    """
+    Clasifica un par FLAIR + T1CE y devuelve el resultado como dict.
+
+    · mode="slice":  un único slice (SLICE_IDX).
+    · mode="volume": ventana de slices en una sola pasada batched, con
+                     probabilidades por slice y una puntuación agregada.
+    """
+    # caché por contenido del par + versión del modelo y de los parámetros
+    key = pair_key(flair_path, t1ce_path, classifier_version(mode, slice_start, slice_end, stride))
+    cached = RESULT_CACHE.get_json("classification", key)
+    if cached is not None:
+        return cached
+
+    result = _classify_scan(flair_path, t1ce_path, mode, slice_start, slice_end, stride)
+    RESULT_CACHE.put_json("classification", key, result)
+    return result
+
+
+def cached_classification(flair_path, t1ce_path, mode="slice"):
+    """Resultado en caché del par con el modelo y parámetros actuales, o None (no ejecuta el modelo)."""
+    return RESULT_CACHE.get_json("classification", pair_key(flair_path, t1ce_path, classifier_version(mode)))
+
+
+def classifier_version(mode="slice", slice_start=None, slice_end=None, stride=None):
+    path = ONNX_MODELS[CLASSIFIER_BACKEND][1] if CLASSIFIER_BACKEND in ONNX_MODELS else MODEL_PATH
+    params = [mode, SLICE_IDX] if mode == "slice" else [
+        mode, slice_start, slice_end, stride or VOLUME_STRIDE, VOLUME_AGGREGATION, VOLUME_TOPK,
+    ]
+    return model_version("classifier", CLASSIFIER_BACKEND, TENSOR_STORE.enabled, *params, paths=(path,))
+
+
+def _classify_scan(flair_path, t1ce_path, mode, slice_start, slice_end, stride):
+    # con el almacén de tensores la entrada se lee ya redimensionada (memmap float16)
+    T = TENSOR_STORE.get(flair_path, t1ce_path) if TENSOR_STORE.enabled else None
+
+    # si no, solo se leen (memmap) los slices axiales necesarios, en float32
+    if mode == "slice":
+        if T is not None:
+            x = slices_from_tensor(T, [SLICE_IDX])
+        else:
+            x = preprocess_slice(read_slice(flair_path, SLICE_IDX), read_slice(t1ce_path, SLICE_IDX))[None]
+        probs = CLASSIFIER_SCHEDULER.run(x)[0]
+        idx = int(probs.argmax())
+        return {
+            "prediction": CLASS_NAMES[idx],
+            "probabilities": {
+                CLASS_NAMES[i]: float(probs[i]) for i in range(len(CLASS_NAMES))
+            }
+        }
+
+    if mode != "volume":
+        raise ValueError(f"Unknown classification mode: {mode}")
+
+    if T is not None:
+        indices = volume_slice_indices(T.shape[0], slice_start, slice_end, stride)
+        x = slices_from_tensor(T, indices)
+    else:
+        flair_img = open_image(flair_path)
+        indices = volume_slice_indices(flair_img.shape[2], slice_start, slice_end, stride)
+        # se lee la ventana contigua completa: es el mismo bloque que usa el segmentador
+        span = (indices[0], min(flair_img.shape[2], VOLUME_SLICE_END if slice_end is None else slice_end))
+        flair_slab = read_slices(flair_path, indices, flair_img, span=span)
+        t1ce_slab  = read_slices(t1ce_path, indices, span=span)
+        x = preprocess_slices(flair_slab, t1ce_slab, range(len(indices)))
+    probs = CLASSIFIER_SCHEDULER.run(x)
+    tumor_idx = CLASS_NAMES.index("Tumor")
+    p_tumor = aggregate_probabilities(probs[:, tumor_idx])
+    return {
+        "prediction": CLASS_NAMES[tumor_idx] if p_tumor >= 0.5 else CLASS_NAMES[1 - tumor_idx],
+        "probabilities": {"No tumor": 1.0 - p_tumor, "Tumor": p_tumor},
+        "p_tumor": p_tumor,
+        "mode": "volume",
+        "aggregation": VOLUME_AGGREGATION,
+        "per_slice": [
+            {"slice": k, "p_tumor": float(p)} for k, p in zip(indices, probs[:, tumor_idx])
+        ],
+    }
 
 # ——— Herramienta de clasificación ———
 @tool(
     name="classify_tumor_from_image",
     description="Clasifica una imagen de un cerebro como 'Tumor' o 'No tumor'.",
 )
-def classify_tumor_from_image(flair_path: str, t1ce_path: str) -> str:
+def classify_tumor_from_image(flair_path: str, t1ce_path: str, mode: str = "slice",
+                              slice_start: int = None, slice_end: int = None,
+                              stride: int = None) -> str:
     """
     Estima la probabilidad de tumor usando un par FLAIR + T1CE.
 
     Args:
         flair_path (str): Ruta al archivo .nii de la imagen FLAIR.
         t1ce_path (str): Ruta al archivo .nii de la imagen T1CE.
+        mode (str): "slice" (un único slice) o "volume" (ventana de slices
+            en una sola pasada, con probabilidad por slice y agregada).
+        slice_start (int): Primer slice axial de la ventana (modo "volume").
+        slice_end (int): Slice final, exclusivo, de la ventana (modo "volume").
+        stride (int): Paso entre slices de la ventana (modo "volume").
 
     Returns:
         str: Resultado de la clasificación en formato JSON.
@@ -109,35 +354,61 @@ def classify_tumor_from_image(flair_path: str, t1ce_path: str) -> str:
             return json.dumps({"error": err})
 
     try:
-        # 2. Cargar modelo (DenseNet-121 con 2 canales)
-        model = load_model(MODEL_PATH)
-
-        # 3. Volúmenes y slice central
-        flair_vol = nib.load(flair_path).get_fdata()
-        t1ce_vol  = nib.load(t1ce_path ).get_fdata()
-        k         = flair_vol.shape[2] // 2
-        print(flair_vol.shape[2] // 2)
-        k=82
-        flair_slice = flair_vol[:, :, k]
-        t1ce_slice  = t1ce_vol [:, :, k]
-
-        # 4. Pre-proceso → (1,2,128,128)
-        x = preprocess_slice(flair_slice, t1ce_slice).unsqueeze(0).to(DEVICE)
-
-        # 5. Inferencia
-        with torch.no_grad():
-            probs = torch.softmax(model(x), dim=1)[0].cpu().numpy()
-        idx = int(probs.argmax())
-
-        result = {
-            "prediction": CLASS_NAMES[idx],
-            "probabilities": {
-                CLASS_NAMES[i]: float(probs[i]) for i in range(len(CLASS_NAMES))
-            }
-        }
-        logger.info(f"Result for {os.path.basename(flair_path)}: {result}")
+        result = classify_scan(flair_path, t1ce_path, mode, slice_start, slice_end, stride)
+        summary = {k: v for k, v in result.items() if k != "per_slice"}
+        logger.info(f"Result for {os.path.basename(flair_path)}: {summary}")
         return json.dumps(result)
 
     except Exception as e:
         logger.error("Classification error", exc_info=True)
         return json.dumps({"error": str(e)})
+
+
+# ——— Herramienta batch (todos los scans del paciente) ———
+CLASSIFICATION_OUTPUT = "data/temp/classification.json"
+
+
+@tool(
+    name="classify_tumor_batch",
+    description="Clasifica todos los pares FLAIR + T1CE de un lister.json en una sola llamada.",
+)
+def classify_tumor_batch(input_file: str = "data/temp/lister.json", mode: str = "slice",
+                         output_file: str = CLASSIFICATION_OUTPUT) -> str:
+    """
+    Clasifica en paralelo todos los scans de `input_file` (formato lister.json).
+    Los volúmenes se cargan concurrentemente y los slices de todos los scans
+    se agrupan en las mismas pasadas del modelo.
+
+    Args:
+        input_file (str): JSON con `patient_identifier` y la lista `scans`.
+        mode (str): "slice" (por defecto, como `classify_tumor_from_image`) o
+            "volume" (ver `classify_tumor_from_image`).
+        output_file (str): Donde se guarda el JSON combinado.
+
+    Returns:
+        str: JSON `{patient_identifier, classifications: [{scan_id, result}]}`.
+    """
+    try:
+        patient, scans = read_scans(input_file)
+    except Exception as e:
+        logger.error(f"Classification batch input error: {e}")
+        return json.dumps({"patient_identifier": "<desconocido>", "error": str(e)})
+
+    def _classify(scan):
+        for p in (scan["flair_path"], scan["t1ce_path"]):
+            if not os.path.isfile(p):
+                return {"error": f"Image file not found: {p}"}
+        result = classify_scan(scan["flair_path"], scan["t1ce_path"], mode)
+        return {k: v for k, v in result.items() if k != "per_slice"}
+
+    results = run_per_scan(scans, _classify)
+    combined = {
+        "patient_identifier": patient,
+        "classifications": [
+            {"scan_id": scan.get("scan_id"), "result": result} for scan, result in zip(scans, results)
+        ],
+    }
+    if output_file:
+        write_json(output_file, combined)
+    logger.info(f"Batch classification for {patient}: {len(scans)} scan(s)")
+    return json.dumps(combined)
@@ -1,36 +1,52 @@
 import os
 import json
+import hashlib
 import logging
-from PIL import Image
-import cv2
 import numpy as np
-import nibabel as nib
-import torch
-import tensorflow as tf
 from strands.tools import tool
-from tensorflow.keras.models import load_model # <--- Esta es la clave
-from sklearn.preprocessing import MinMaxScaler # Para normalizar las imágenes
-from matplotlib.patches import Patch
-from matplotlib.colors import ListedColormap, BoundaryNorm
-import matplotlib
-from skimage.transform import resize
-from skimage.measure import find_contours
-#import matplotlib
-#matplotlib.use('TkAgg') 
-import matplotlib.pyplot as plt
+from src.tools.model_registry import MODEL_REGISTRY
+from src.tools.inference_scheduler import MicroBatchScheduler
+from src.tools.inference_workers import INFERENCE_MODE, WORKERS
+from src.tools.volume_preprocessing import preprocess_volume, find_brain_roi, window_from_tensor
+from src.tools.onnx_runtime_backend import SEGMENTER_ONNX_PATH, create_session, run_session
+from src.tools.segmentation_gate import SEGMENTATION_GATE
+from src.tools.result_cache import RESULT_CACHE, model_version, pair_key
+from src.tools.scan_batch import read_scans, run_per_scan, write_json
+from src.tools.volume_reader import read_slab, scan_id_from_path, volume_info
+from src.tools.tensor_store import TENSOR_STORE
+from src.tools.slice_renderer import to_gray, upscale, overlay_labels, overlay_probability, save_png
+from src.tools.mask_encoding import write_mask_rle
+from src.tools.lesion_analytics import lesion_analytics
 # ——— Configuración básica ———
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-DEVICE        = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 CLASS_NAMES   = ["No tumor", "Tumor"]
 MODEL_PATH    = "data/models/brain_tumor_segmentation.h5"
 WEIGHTS_PATH  = "data/models/model_26-0.023368.weights.h5"
 
+# ——— Backend de inferencia ———
+# "keras" (predict de Keras), "keras-compiled" (tf.function con firma fija)
+# u "onnx" (onnxruntime, sin cargar TensorFlow en el proceso)
+SEGMENTER_BACKEND      = os.getenv("SEGMENTER_BACKEND", "keras")
+SEGMENTER_ONNX_THREADS = int(os.getenv("SEGMENTER_ONNX_THREADS", "0"))  # 0 → lo decide ORT
+
+# ruta compilada: batch fijo (el último trozo se rellena con ceros), XLA y bf16 opcionales
+COMPILED_BATCH_SIZE = int(os.getenv("SEGMENTER_COMPILED_BATCH", "20"))
+COMPILED_XLA        = os.getenv("SEGMENTER_XLA", "0") == "1"
+COMPILED_BF16       = os.getenv("SEGMENTER_BF16", "0") == "1"
+
+# modo adaptativo: solo se infieren los slices con cerebro, recortados a su caja
+SEGMENTER_ROI = os.getenv("SEGMENTER_ROI", "0") == "1"
+
 IMG_SIZE = 128
 VOLUME_SLICES = 100
 VOLUME_START_AT = 22 # first slice of volume that we will include
 SELECTED_SLICE_IDX=60
+
+# micro-batching entre peticiones (en slices)
+BATCH_MAX_SIZE    = int(os.getenv("SEGMENTER_BATCH_MAX_SIZE", str(2 * VOLUME_SLICES)))
+BATCH_MAX_WAIT_MS = float(os.getenv("SEGMENTER_BATCH_MAX_WAIT_MS", "10"))
 PALETTE = np.array([
     [0,   0,   0],    # fondo
     [255, 0,   0],    # clase 1 (necrosis)
@@ -45,8 +61,6 @@ SEGMENT_CLASSES = {
     3 : 'ENHANCING' # original 4 -> converted into 3
 }
 
-cmap = matplotlib.colors.ListedColormap(["#000000", "#1121b2", "#0c8f61", "#930000"])
-norm = matplotlib.colors.BoundaryNorm([-0.5, 0.5, 1.5, 2.5, 3.5], cmap.N)
 
 
 OUT_INPUT_DIR = "data/segmentations/"
@@ -56,6 +70,17 @@ OUT_INPUT_DIR = "data/segmentations/"
 
 
 
+# TensorFlow solo se importa cuando se usa el backend "keras"
+tf = None
+
+def _import_tensorflow():
+    global tf
+    if tf is None:
+        import tensorflow
+        tf = tensorflow
+    return tf
+
+
 #--------------------------METRICAS DE EVALUACION---------------
 def dice_coef(y_true, y_pred, smooth=100):
     y_true_f = tf.keras.backend.flatten(y_true)
@@ -92,16 +117,18 @@ def specificity(y_true, y_pred):
 
 
 
-custom_objects = {
-    'dice_coef': dice_coef,
-    'dice_coef_necrotic': dice_coef_necrotic,
-    'dice_coef_edema': dice_coef_edema,
-    'dice_coef_enhancing': dice_coef_enhancing,
-    'precision': precision,
-    'sensitivity': sensitivity,
-    'specificity': specificity,
-    'MeanIoU': tf.keras.metrics.MeanIoU(num_classes=4) # tf.keras.metrics.MeanIoU también debe pasarse si fue personalizado
-}
+def get_custom_objects():
+    _import_tensorflow()
+    return {
+        'dice_coef': dice_coef,
+        'dice_coef_necrotic': dice_coef_necrotic,
+        'dice_coef_edema': dice_coef_edema,
+        'dice_coef_enhancing': dice_coef_enhancing,
+        'precision': precision,
+        'sensitivity': sensitivity,
+        'specificity': specificity,
+        'MeanIoU': tf.keras.metrics.MeanIoU(num_classes=4) # tf.keras.metrics.MeanIoU también debe pasarse si fue personalizado
+    }
 
 
 
@@ -110,6 +137,7 @@ custom_objects = {
 def load_model(model_path: str,weights_path: str):
     if not os.path.exists(model_path):
         raise FileNotFoundError(f"Model not found: {model_path}")
+    custom_objects = get_custom_objects()
     model = tf.keras.models.load_model(model_path, custom_objects=custom_objects,compile=False)
     if not os.path.exists(weights_path):
         raise FileNotFoundError(f"Weights not found: {weights_path}")
@@ -118,198 +146,343 @@ def load_model(model_path: str,weights_path: str):
     return model
 
 
+def warmup_model(model):
+    """Una pasada en vacío para construir el grafo de inferencia."""
+    model.predict(np.zeros((1, IMG_SIZE, IMG_SIZE, 2), dtype=np.float32), verbose=0)
 
 
-def showPredicts(p,flair,flair_path,t1ce, start_slice=SELECTED_SLICE_IDX):
-    """Muestra 6 figuras independientes (FLAIR, GT, pred y clases) para un slice."""
+def load_onnx_session(onnx_path: str):
+    return create_session(onnx_path, intra_op_threads=SEGMENTER_ONNX_THREADS)
 
-    os.makedirs(OUT_INPUT_DIR, exist_ok=True)
 
+def warmup_onnx_session(session):
+    run_session(session, np.zeros((1, IMG_SIZE, IMG_SIZE, 2), dtype=np.float32))
 
 
-    core = p[:,:,:,1]
-    edema= p[:,:,:,2]
-    enhancing = p[:,:,:,3]
-
-
-
-    k = start_slice + VOLUME_START_AT  
-    ups = 4  # factor de escala para la vista
-    flair_vis = cv2.resize(flair[:, :, k],(IMG_SIZE*ups, IMG_SIZE*ups),
-            interpolation=cv2.INTER_CUBIC)
-    t1ce_vis = cv2.resize(t1ce[:, :, k],(IMG_SIZE*ups, IMG_SIZE*ups),
-            interpolation=cv2.INTER_CUBIC) 
-    mask_all = cv2.resize(p[start_slice, :, :, 1:4],(IMG_SIZE*ups,IMG_SIZE*ups),
-            interpolation=cv2.INTER_NEAREST) 
-    mask_core = cv2.resize(core[start_slice,:,:],(IMG_SIZE*ups, IMG_SIZE*ups),
-            interpolation=cv2.INTER_NEAREST)
-    mask_edema = cv2.resize(edema[start_slice,:,:],(IMG_SIZE*ups, IMG_SIZE*ups),
-            interpolation=cv2.INTER_NEAREST)
-    mask_enhancing = cv2.resize(enhancing[start_slice,:,:],(IMG_SIZE*ups,IMG_SIZE*ups),interpolation=cv2.INTER_NEAREST)
-
-
-
-
-    # corte real en el volumen
-    flair_2d = cv2.resize(flair[:, :, k], (IMG_SIZE, IMG_SIZE))
-
-
-    #gt_2d    = cv2.resize(gt[:, :, k],    (IMG_SIZE, IMG_SIZE), interpolation=cv2.INTER_NEAREST)
-
-
-    # 1) FLAIR original
-    # plt.figure(figsize=(6, 6), dpi=200)
-    # plt.imshow(flair_2d, cmap='gray')
-    # plt.title('Original FLAIR')
-    # plt.axis('off')
-    # plt.savefig(png_input, bbox_inches='tight', pad_inches=0)
-
-    plt.figure(figsize=(6, 6), dpi=200)
-    plt.imshow(flair_vis, cmap='gray',interpolation='bilinear')
-    plt.title('Original FLAIR ')
-    plt.axis('off')
-    png_input = os.path.join( OUT_INPUT_DIR+f"FLAIR_slice_{k}_"+ os.path.basename(flair_path).replace("_flair.nii", ".png"))
-    plt.savefig(png_input, bbox_inches='tight', pad_inches=0)
-    plt.close() 
-    
-    # 2) Ground-truth
-    if False:
-        plt.figure(figsize=(4,4))
-        plt.imshow(flair_2d, cmap='gray')
-        plt.imshow(gt_2d, cmap='Reds', alpha=0.3, interpolation='none')
-        plt.title('Ground truth')
-        plt.axis('off')
-
-    # 3) All Clases
-    # plt.figure(figsize=(6, 6), dpi=200)
-    # plt.imshow(flair_2d, cmap='gray')
-    # plt.imshow(p[start_slice,:,:,1:4], cmap='Reds', alpha=0.3, interpolation='none')
-    # plt.title('All classes predicted')
-    # plt.axis('off')
-    # plt.savefig(png_overlay, bbox_inches='tight', pad_inches=0)
-
-    plt.figure(figsize=(6, 6), dpi=200)
-    plt.imshow(flair_vis, cmap='gray', interpolation='bilinear')
-    plt.imshow(mask_all, cmap='Reds', alpha=0.3, interpolation='nearest')
-    plt.title('All classes predicted')
-    plt.axis('off')
-    png_overlay = ( OUT_INPUT_DIR+"Resultado_segmentacion_superpuesto_"
-    + os.path.basename(flair_path).replace("_flair.nii", ".png"))
-    plt.savefig(png_overlay, bbox_inches='tight', pad_inches=0)
-    plt.close() 
-
-
-    # 4) Core
-    # plt.figure(figsize=(4,4))
-    # plt.imshow(flair_2d, cmap='gray')
-    # plt.imshow(core[start_slice,:,:], cmap='Reds', alpha=0.3, interpolation='none')
-
-    plt.figure(figsize=(6, 6), dpi=200)
-    plt.imshow(flair_vis, cmap='gray', interpolation='bilinear')
-    plt.imshow(mask_core, cmap='Reds', alpha=0.3, interpolation='nearest')
-    plt.title(f'{SEGMENT_CLASSES[1]} predicted')
-    plt.axis('off')
-    png_core = os.path.join( OUT_INPUT_DIR+f"Resultado_segmentacion_{SEGMENT_CLASSES[1]}_"+ os.path.basename(flair_path).replace("_flair.nii", ".png"))
-    plt.savefig(png_core, bbox_inches='tight', pad_inches=0)
-    
-    plt.axis('off')
-
-
-    # 4) Edema
-    # plt.figure(figsize=(4,4))
-    # plt.imshow(flair_2d, cmap='gray')
-    # plt.imshow(edema[start_slice,:,:], cmap='Reds', alpha=0.3, interpolation='none')
-    plt.figure(figsize=(6, 6), dpi=200)
-    plt.imshow(flair_vis, cmap='gray', interpolation='bilinear')
-    plt.imshow(mask_edema, cmap='Reds', alpha=0.3, interpolation='nearest')
-    plt.title(f'{SEGMENT_CLASSES[2]} predicted')
-    plt.axis('off')
-    png_mask = (OUT_INPUT_DIR+"Resultado_segmentacion_" + os.path.basename(flair_path).replace("_flair.nii", ".png"))
-    plt.savefig(png_mask, bbox_inches='tight', pad_inches=0)
-    plt.close() 
-
-    # 4) enhancing
-    # plt.figure(figsize=(4,4))
-    # plt.imshow(flair_2d, cmap='gray')
-    # plt.imshow(enhancing[start_slice,:,:], cmap='Reds', alpha=0.3, interpolation='none')
-    plt.figure(figsize=(6, 6), dpi=200)
-    plt.imshow(flair_vis, cmap='gray', interpolation='bilinear')
-    plt.imshow(mask_enhancing, cmap='Reds', alpha=0.3, interpolation='nearest')    
-    plt.title(f'{SEGMENT_CLASSES[3]} predicted')
-    plt.axis('off')
-    png_enhancing = os.path.join( OUT_INPUT_DIR+f"Resultado_segmentacion_{SEGMENT_CLASSES[3]}_"+ os.path.basename(flair_path).replace("_flair.nii", ".png"))
-    plt.savefig(png_enhancing, bbox_inches='tight', pad_inches=0)
-    plt.axis('off')
-
-
-    plt.figure(figsize=(6, 6), dpi=200)
-    plt.imshow(t1ce_vis, cmap='gray',interpolation='bilinear')
-    plt.title('Original FLAIR ')
-    plt.axis('off')
-    png_t1ce = os.path.join( OUT_INPUT_DIR+f"T1CE_slice_{k}_"+ os.path.basename(flair_path).replace("_flair.nii", ".png"))
-    plt.savefig(png_t1ce, bbox_inches='tight', pad_inches=0)
-    plt.close() 
-
-
-    #plt.show()
-
-
-
-    figures = [
-        ("Original FLAIR",                     flair_2d,                    None),
-        ("All classes predicted",              p[start_slice, :, :, 1:4],   None),
-        (f'{SEGMENT_CLASSES[1]} predicted',    core[start_slice, :, :],     None),
-        (f'{SEGMENT_CLASSES[2]} predicted',    edema[start_slice, :, :],    None),
-        (f'{SEGMENT_CLASSES[3]} predicted',    enhancing[start_slice, :, :],None),
-    ]
+class CompiledUNet:
+    """
+    U-Net envuelta en un `tf.function` con firma fija (batch,128,128,2) float32:
+    sin bucle de `predict`, sin barra de progreso y sin retrazados por forma.
+    """
 
+    def __init__(self, model, batch_size=COMPILED_BATCH_SIZE, jit_compile=COMPILED_XLA, bf16=COMPILED_BF16):
+        tf = _import_tensorflow()
+        self.model      = model
+        self.batch_size = batch_size
+        self.net        = _to_mixed_bfloat16(model) if bf16 else model
 
-    return png_input, png_mask, png_overlay,k
+        spec = tf.TensorSpec((batch_size, IMG_SIZE, IMG_SIZE, 2), tf.float32)
+
+        @tf.function(input_signature=[spec], jit_compile=jit_compile)
+        def _infer(x):
+            return tf.cast(self.net(x, training=False), tf.float32)
+
+        self._infer = _infer
+
+    def count_params(self):
+        return self.model.count_params()
+
+    def predict(self, X):
+        X = np.asarray(X, dtype=np.float32)
+        n, bs = X.shape[0], self.batch_size
+        out = np.empty((n, IMG_SIZE, IMG_SIZE, 4), dtype=np.float32)
+        chunk = np.zeros((bs, IMG_SIZE, IMG_SIZE, 2), dtype=np.float32)
+        for i in range(0, n, bs):
+            m = min(bs, n - i)
+            chunk[:m] = X[i:i + m]
+            chunk[m:] = 0.0
+            out[i:i + m] = self._infer(chunk).numpy()[:m]
+        return out
+
+
+def _to_mixed_bfloat16(model):
+    """Clona la U-Net con política mixed_bfloat16 (la capa de salida sigue en float32)."""
+    tf = _import_tensorflow()
+    last = model.layers[-1].name
+
+    def clone_layer(layer):
+        config = layer.get_config()
+        if layer.name != last and not isinstance(layer, tf.keras.layers.InputLayer):
+            config["dtype"] = "mixed_bfloat16"
+        return layer.__class__.from_config(config)
 
+    clone = tf.keras.models.clone_model(model, clone_function=clone_layer)
+    clone.set_weights(model.get_weights())
+    return clone
 
 
+def load_compiled_model(model_path: str, weights_path: str):
+    return CompiledUNet(load_model(model_path, weights_path))
 
 
+def warmup_compiled_model(compiled):
+    compiled.predict(np.zeros((1, IMG_SIZE, IMG_SIZE, 2), dtype=np.float32))
 
 
+# solo se precarga el modelo del backend activo
+MODEL_REGISTRY.register("segmenter", load_model, default_paths=(MODEL_PATH, WEIGHTS_PATH), warmup=warmup_model,
+                        preload=SEGMENTER_BACKEND == "keras")
+MODEL_REGISTRY.register("segmenter_compiled", load_compiled_model, default_paths=(MODEL_PATH, WEIGHTS_PATH),
+                        warmup=warmup_compiled_model, preload=SEGMENTER_BACKEND == "keras-compiled")
+MODEL_REGISTRY.register("segmenter_onnx", load_onnx_session, default_paths=(SEGMENTER_ONNX_PATH,),
+                        warmup=warmup_onnx_session, preload=SEGMENTER_BACKEND == "onnx")
 
 
+def predict_volume(X, backend=None):
+    """Inferencia batched de la U-Net: (N,128,128,2) → (N,128,128,4)."""
+    backend = backend or SEGMENTER_BACKEND
+    if backend == "onnx":
+        session = MODEL_REGISTRY.get("segmenter_onnx", SEGMENTER_ONNX_PATH)
+        return run_session(session, X)
+    if backend == "keras-compiled":
+        return MODEL_REGISTRY.get("segmenter_compiled", MODEL_PATH, WEIGHTS_PATH).predict(X)
 
-def show_predicted_segmentations(p,slice_to_plot=SELECTED_SLICE_IDX):
+    model = MODEL_REGISTRY.get("segmenter", MODEL_PATH, WEIGHTS_PATH)
+    return model.predict(X, verbose=1)
 
-    predicted_seg=p
-    all = predicted_seg[slice_to_plot,:,:,1:4] # Deletion of class 0 (Keep only Core + Edema + Enhancing classes)
-    zero = predicted_seg[slice_to_plot,:,:,0] # Isolation of class 0, Background (kind of useless, it is the opposite of the "all")
-    core = predicted_seg[slice_to_plot,:,:,1] # Isolation of class 1, Core
-    edema = predicted_seg[slice_to_plot,:,:,2] # Isolation of class 2, Edema
-    enhancing = predicted_seg[slice_to_plot,:,:,3] # Isolation of class 3, Enhancing
 
-    plt.figure(figsize=(6, 6), dpi=200)
-    plt.imshow(all, cmap='gray')
-    plt.title(f'Predicted Segmentation - All classes predicted')
-    plt.axis('off')
+def _supports_crop(backend=None):
+    """True si el modelo del backend acepta entradas con alto/ancho variable."""
+    if INFERENCE_MODE == "workers" and backend is None:
+        return False  # el modelo vive en el worker; solo se omiten slices
+    backend = backend or SEGMENTER_BACKEND
+    if backend == "onnx":
+        shape = MODEL_REGISTRY.get("segmenter_onnx", SEGMENTER_ONNX_PATH).get_inputs()[0].shape
+        return not isinstance(shape[1], int) and not isinstance(shape[2], int)
+    if backend == "keras":
+        shape = MODEL_REGISTRY.get("segmenter", MODEL_PATH, WEIGHTS_PATH).input_shape
+        return shape[1] is None and shape[2] is None
+    return False  # la ruta compilada tiene firma fija
 
-    plt.figure(figsize=(4,4))
-    plt.imshow(core, cmap, norm)
-    plt.title(f'Predicted Segmentation - {SEGMENT_CLASSES[1]} predicted')
-    plt.axis('off')
 
-    plt.figure(figsize=(4,4))
-    plt.imshow(edema, cmap, norm)
-    plt.title(f'Predicted Segmentation - {SEGMENT_CLASSES[2]} predicted')
-    plt.axis('off')
+def predict_volume_roi(X, backend=None):
+    """
+    Segmentación adaptativa: omite los slices sin cerebro y, si el modelo lo
+    permite, recorta cada slice a la caja del cerebro. El resultado se rellena
+    con fondo hasta tener la misma forma (N,128,128,4) que `predict_volume`.
+    """
+    p = np.zeros(X.shape[:3] + (4,), dtype=np.float32)
+    p[..., 0] = 1.0  # fondo en todo lo que no se infiere
+
+    roi = find_brain_roi(X)
+    if roi is None:
+        logger.info("ROI: no brain-bearing slices found, skipping inference")
+        return p
+    slices, (r0, r1, c0, c1) = roi
+
+    if _supports_crop(backend):
+        crop = np.ascontiguousarray(X[slices, r0:r1, c0:c1])
+        p[slices, r0:r1, c0:c1] = predict_volume(crop, backend)
+    else:
+        crop = np.ascontiguousarray(X[slices])
+        r0, r1, c0, c1 = 0, X.shape[1], 0, X.shape[2]
+        p[slices] = SEGMENTER_SCHEDULER.run(crop) if backend is None else predict_volume(crop, backend)
+
+    computed = crop.shape[0] * crop.shape[1] * crop.shape[2]
+    logger.info(f"ROI: {len(slices)}/{X.shape[0]} slices, box rows {r0}:{r1} cols {c0}:{c1} "
+                f"({100.0 * computed / X[..., 0].size:.0f}% of full compute)")
+    return p
+
+
+def check_compiled_parity(X, atol=1e-3):
+    """
+    Compara la ruta compilada con `model.predict` sobre la misma entrada.
+    Devuelve diferencias de probabilidad y concordancia de etiquetas por vóxel.
+    """
+    reference = MODEL_REGISTRY.get("segmenter", MODEL_PATH, WEIGHTS_PATH).predict(X, verbose=0)
+    compiled  = MODEL_REGISTRY.get("segmenter_compiled", MODEL_PATH, WEIGHTS_PATH).predict(X)
+    diff = np.abs(reference - compiled)
+    report = {
+        "max_abs_diff": float(diff.max()),
+        "mean_abs_diff": float(diff.mean()),
+        "label_agreement": float((reference.argmax(-1) == compiled.argmax(-1)).mean()),
+        "xla": COMPILED_XLA,
+        "bf16": COMPILED_BF16,
+    }
+    report["passed"] = report["max_abs_diff"] <= atol
+    logger.info(f"Compiled U-Net parity: {report}")
+    return report
+
+
+def _run_batch(X):
+    # con INFERENCE_MODE=workers la pasada se hace en el subproceso del segmentador
+    if INFERENCE_MODE == "workers":
+        return WORKERS.run("segmenter", X)
+    return predict_volume(X)
+
+
+SEGMENTER_SCHEDULER = MicroBatchScheduler(
+    "segmenter", _run_batch,
+    max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS,
+)
 
-    plt.figure(figsize=(4,4))
-    plt.imshow(enhancing, cmap='gray')
-    plt.title(f'Predicted Segmentation - {SEGMENT_CLASSES[3]} predicted')
-    plt.axis('off')
-    #plt.show()
 
-    return None
+# ——— Caché de resultados ———
+PNG_FIELDS    = ("input_slice", "mask_file", "overlay_file")
+OUTPUT_FIELDS = PNG_FIELDS + ("mask_rle_file",)
 
 
+def segmenter_version():
+    paths = (SEGMENTER_ONNX_PATH,) if SEGMENTER_BACKEND == "onnx" else (MODEL_PATH, WEIGHTS_PATH)
+    return model_version("segmenter", SEGMENTER_BACKEND, SEGMENTER_ROI, TENSOR_STORE.enabled,
+                         VOLUME_START_AT, VOLUME_SLICES, IMG_SIZE, paths=paths)
 
 
+def segmentation_key(flair_path, t1ce_path):
+    """Clave de RESULT_CACHE de la segmentación del par con el modelo actual."""
+    return pair_key(flair_path, t1ce_path, segmenter_version())
+
+
+def rendered_key(key, flair_path):
+    """
+    Clave del JSON con las rutas de los PNGs y del RLE: las máscaras (.npz) se
+    comparten entre ficheros con el mismo contenido, pero los ficheros renderizados
+    llevan el scan_id en el nombre y son de la ruta que los pidió.
+    """
+    return hashlib.sha256(f"{key}\0{os.path.abspath(flair_path)}".encode()).hexdigest()
+
+
+def _output_mtimes(result):
+    """mtime de cada fichero renderizado, o None si falta alguno."""
+    try:
+        return {k: os.stat(result[k]).st_mtime_ns for k in OUTPUT_FIELDS}
+    except (KeyError, TypeError, OSError):
+        return None
+
+
+def cached_mask(key):
+    """Máscara (100,128,128) uint8 ya calculada para `key`, o None (solo descomprime la máscara)."""
+    arrays = RESULT_CACHE.get_arrays("segmentation", key, names=("mask",))
+    return None if arrays is None else arrays["mask"]
+
+
+def lesion_from_cache(flair_path, t1ce_path):
+    """Analítica de la lesión a partir de la máscara en caché, o None si el par no está segmentado."""
+    mask = cached_mask(segmentation_key(flair_path, t1ce_path))
+    if mask is None:
+        return None
+    return lesion_analytics(mask, volume_info(flair_path), VOLUME_START_AT)
+
+
+def preprocessed_input(flair_path, t1ce_path):
+    """Entrada (100,128,128,2) float32 normalizada, desde el almacén de tensores o desde el NIfTI."""
+    if TENSOR_STORE.enabled:
+        return window_from_tensor(TENSOR_STORE.get(flair_path, t1ce_path), VOLUME_START_AT, VOLUME_SLICES)
+    # solo los slices [VOLUME_START_AT, VOLUME_START_AT + VOLUME_SLICES), en float32
+    stop = VOLUME_START_AT + VOLUME_SLICES
+    flair = read_slab(flair_path, VOLUME_START_AT, stop)
+    t1ce  = read_slab(t1ce_path, VOLUME_START_AT, stop)
+    # (100,128,128,2) float32 normalizado, en una sola pasada vectorizada
+    return preprocess_volume(flair, t1ce, 0, VOLUME_SLICES, IMG_SIZE)
+
+
+def segment_volume(flair_path, t1ce_path, key=None):
+    """
+    Probabilidades (100,128,128,4) del par. Con `key`, la predicción se lee de
+    la caché (probabilidades float16 + máscara uint8 en .npz) o se guarda en ella.
+    """
+    arrays = RESULT_CACHE.get_arrays("segmentation", key) if key else None
+    if arrays is not None:
+        return arrays["probs"].astype(np.float32)
+
+    X = preprocessed_input(flair_path, t1ce_path)
+    p = predict_volume_roi(X) if SEGMENTER_ROI else SEGMENTER_SCHEDULER.run(X)
+    if key:
+        RESULT_CACHE.put_arrays("segmentation", key,
+                                probs=p.astype(np.float16), mask=p.argmax(-1).astype(np.uint8))
+    return p
+
+
+
+
+def showPredicts(p,flair,flair_path,t1ce, start_slice=SELECTED_SLICE_IDX, offset=0):
+    """
+    Guarda los PNGs de un slice: FLAIR y T1CE originales, superposición de
+    todas las clases y superposición por clase (núcleo necrótico, edema, realce).
+    `offset` es el índice del primer slice de `flair`/`t1ce` si son un bloque parcial.
+
+    Returns:
+        (png_input, png_mask, png_overlay, k) con k el slice del volumen original.
+    """
+
+    os.makedirs(OUT_INPUT_DIR, exist_ok=True)
+    scan_id = scan_id_from_path(flair_path)
+
+    k = start_slice + VOLUME_START_AT
+    size = IMG_SIZE * 4  # factor de escala para la vista
+    flair_vis = upscale(to_gray(flair[:, :, k - offset]), size)
+    t1ce_vis  = upscale(to_gray(t1ce[:, :, k - offset]), size)
+    probs  = upscale(np.ascontiguousarray(p[start_slice], dtype=np.float32), size, nearest=True)
+    labels = probs.argmax(-1).astype(np.uint8)
+
+    png_input   = save_png(flair_vis, OUT_INPUT_DIR + f"FLAIR_slice_{k}_" + scan_id + ".png")
+    save_png(t1ce_vis, OUT_INPUT_DIR + f"T1CE_slice_{k}_" + scan_id + ".png")
+    png_overlay = save_png(overlay_labels(flair_vis, labels, PALETTE),
+                           OUT_INPUT_DIR + "Resultado_segmentacion_superpuesto_" + scan_id + ".png")
+    png_core      = OUT_INPUT_DIR + f"Resultado_segmentacion_{SEGMENT_CLASSES[1]}_" + scan_id + ".png"
+    png_mask      = OUT_INPUT_DIR + "Resultado_segmentacion_" + scan_id + ".png"   # edema
+    png_enhancing = OUT_INPUT_DIR + f"Resultado_segmentacion_{SEGMENT_CLASSES[3]}_" + scan_id + ".png"
+    for cls, path in ((1, png_core), (2, png_mask), (3, png_enhancing)):
+        save_png(overlay_probability(flair_vis, probs[:, :, cls], PALETTE[cls]), path)
+
+    return png_input, png_mask, png_overlay,k
+
+
+
+
+
+def segment_scan(flair_path, t1ce_path, p_tumor=None, threshold=None):
+    """
+    Puerta de segmentación → caché → U-Net → PNGs para un par FLAIR + T1CE.
+    Devuelve el resultado como dict (`skipped` si la puerta omite el scan).
+    """
+    gate = SEGMENTATION_GATE.decide(flair_path, t1ce_path, p_tumor, threshold)
+    if not gate["segment"]:
+        return {
+            "skipped": True,
+            "reason": "p_tumor below segmentation threshold",
+            "p_tumor": gate["p_tumor"],
+            "threshold": gate["threshold"],
+        }
+
+    # mismo contenido + mismo modelo + misma ruta → resultado en caché, sin decodificar
+    # volúmenes; solo si sigue la máscara .npz que sirve /mask y nadie ha reescrito
+    # desde entonces los PNGs/RLE del scan (otro contenido subido con el mismo nombre)
+    key = segmentation_key(flair_path, t1ce_path)
+    json_key = rendered_key(key, flair_path)
+    cached = RESULT_CACHE.get_json("segmentation", json_key)
+    if cached is not None and RESULT_CACHE.has_arrays("segmentation", key) and \
+            "lesion" in cached.get("result", {}) and _output_mtimes(cached["result"]) == cached.get("outputs"):
+        return cached["result"]
+
+    p = segment_volume(flair_path, t1ce_path, key)
+
+    # el render solo necesita el slice mostrado a resolución original
+    k = SELECTED_SLICE_IDX + VOLUME_START_AT
+    flair = read_slab(flair_path, k, k + 1)
+    t1ce  = read_slab(t1ce_path, k, k + 1)
+
+    png_input, png_mask,png_overlay,selected_slice=showPredicts(p,flair,flair_path,t1ce, offset=k)
+
+    # máscara completa en RLE por clase y slice, para que el frontend dibuje sus propias capas
+    info = volume_info(flair_path)
+    mask = p.argmax(-1).astype(np.uint8)
+    rle_file = write_mask_rle(OUT_INPUT_DIR + scan_id_from_path(flair_path) + "_mask_rle.json",
+                              mask, VOLUME_START_AT, info.shape)
+    # volúmenes, componentes, centroide y caja en mm con el spacing del NIfTI
+    lesion = lesion_analytics(mask, info, VOLUME_START_AT)
+
+    result = {
+        "slice":selected_slice,
+        "input_slice": png_input,
+        "mask_file"  : png_mask,
+        "overlay_file": png_overlay,
+        "mask_rle_file": rle_file,
+        "volumen_cc": lesion["total_cc"],
+        "lesion": lesion
+    }
+    RESULT_CACHE.put_json("segmentation", json_key, {"result": result, "outputs": _output_mtimes(result)})
+    return result
 
 
 # ——— Herramienta de Segmentacion ———
@@ -317,14 +490,23 @@ def show_predicted_segmentations(p,slice_to_plot=SELECTED_SLICE_IDX):
     name="segmenter_tumor_from_image",
     description="Segmenta un tumor cerebral a partir de imágenes FLAIR y T1CE.",
 )
-def segmenter_tumor_from_image(flair_path: str, t1ce_path: str) -> str:
+def segmenter_tumor_from_image(flair_path: str, t1ce_path: str,
+                               p_tumor: float = None, threshold: float = None) -> str:
     """
     Segmenta una única imagen. NO BUSCA ficheros: espera recibir
     la ruta exacta al archivo de imagen.
 
+    Si la probabilidad de tumor del scan queda por debajo del umbral de la
+    puerta de segmentación, no se ejecuta la U-Net y se devuelve
+    `{"skipped": true, ...}`.
+
     Args:
         flair_path (str): Ruta al archivo .nii de la imagen FLAIR.
         t1ce_path (str): Ruta al archivo .nii de la imagen T1CE.
+        p_tumor (float): Probabilidad de tumor ya calculada (opcional; si falta
+            se toma de la caché de clasificaciones o del clasificador).
+        threshold (float): Umbral para esta llamada (opcional; manda el de la
+            petición /query si se fijó).
 
     Returns:
         str: Resultado de la segmentación en formato JSON.
@@ -335,34 +517,59 @@ def segmenter_tumor_from_image(flair_path: str, t1ce_path: str) -> str:
             logger.error(err)
             return json.dumps({"error": err})
     try:
-        model = load_model(MODEL_PATH, WEIGHTS_PATH)
-        
+        return json.dumps(segment_scan(flair_path, t1ce_path, p_tumor, threshold))
 
-        X = np.empty((VOLUME_SLICES, IMG_SIZE, IMG_SIZE, 2))
-        flair=nib.load(flair_path).get_fdata()
-        t1ce=nib.load(t1ce_path).get_fdata()
-
-        for j in range(VOLUME_SLICES):
-            X[j,:,:,0] = cv2.resize(flair[:,:,j+VOLUME_START_AT], (IMG_SIZE,IMG_SIZE))
-            X[j,:,:,1] = cv2.resize(t1ce[:,:,j+VOLUME_START_AT], (IMG_SIZE,IMG_SIZE))
+    except Exception as e:
+        logger.error(f"Segmentación error: {e}", exc_info=True)
+        return json.dumps({"error": str(e)})
 
-        p = model.predict(X/np.max(X), verbose=1)
 
+SEGMENTATION_OUTPUT = "data/temp/segmentation.json"
 
-        png_input, png_mask,png_overlay,selected_slice=showPredicts(p,flair,flair_path,t1ce)
-        show_predicted_segmentations(p)
 
+@tool(
+    name="segmenter_tumor_batch",
+    description="Segmenta todos los pares FLAIR + T1CE de un lister.json en una sola llamada.",
+)
+def segmenter_tumor_batch(input_file: str = "data/temp/lister.json", threshold: float = None,
+                          output_file: str = SEGMENTATION_OUTPUT) -> str:
+    """
+    Segmenta en paralelo todos los scans de `input_file` (formato lister.json).
+    Los volúmenes se cargan y pre-procesan concurrentemente y los slices de
+    todos los scans se agrupan en las mismas pasadas de la U-Net.
 
-        return json.dumps({
-            "slice":selected_slice,
-            "input_slice": png_input,
-            "mask_file"  : png_mask,
-            "overlay_file": png_overlay
-        })
+    Args:
+        input_file (str): JSON con `patient_identifier` y la lista `scans`.
+        threshold (float): Umbral de la puerta de segmentación (opcional; manda
+            el de la petición /query si se fijó).
+        output_file (str): Donde se guarda el JSON combinado.
 
+    Returns:
+        str: JSON `{patient_identifier, "data/segmentations": [{scan_id, ...}]}`.
+    """
+    try:
+        patient, scans = read_scans(input_file)
     except Exception as e:
-        logger.error(f"Segmentación error: {e}", exc_info=True)
-        return json.dumps({"error": str(e)})
+        logger.error(f"Segmentation batch input error: {e}")
+        return json.dumps({"patient_identifier": "<desconocido>", "error": str(e)})
+
+    def _segment(scan):
+        for p in (scan["flair_path"], scan["t1ce_path"]):
+            if not os.path.isfile(p):
+                return {"error": f"Image file not found: {p}"}
+        return segment_scan(scan["flair_path"], scan["t1ce_path"], threshold=threshold)
+
+    results = run_per_scan(scans, _segment)
+    combined = {
+        "patient_identifier": patient,
+        "data/segmentations": [
+            {"scan_id": scan.get("scan_id"), **result} for scan, result in zip(scans, results)
+        ],
+    }
+    if output_file:
+        write_json(output_file, combined)
+    logger.info(f"Batch segmentation for {patient}: {len(scans)} scan(s)")
+    return json.dumps(combined)
 
 
 
@@ -0,0 +1,163 @@
+"""
+inference_scheduler.py
+Planificador de micro-batching entre peticiones.
+
+Cada petición en curso encola su tensor de slices (primera dimensión = batch)
+y un hilo por modelo agrupa los tensores de todas las peticiones hasta
+`max_batch_size` filas o `max_wait_ms` milisegundos, ejecuta una única pasada
+sobre el modelo compartido y reparte los resultados a cada llamante.
+"""
+
+import os
+import queue
+import threading
+import time
+import logging
+from collections import Counter, deque
+from concurrent.futures import Future
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+BATCHING_ENABLED = os.getenv("INFERENCE_BATCHING", "1") == "1"
+WAIT_SAMPLES     = 1000  # nº de esperas recientes usadas en las estadísticas
+
+SCHEDULERS = {}  # name -> MicroBatchScheduler
+
+
+class _Request:
+    __slots__ = ("x", "rows", "future", "enqueued")
+
+    def __init__(self, x):
+        self.x        = x
+        self.rows     = int(x.shape[0])
+        self.future   = Future()
+        self.enqueued = time.perf_counter()
+
+
+class MicroBatchScheduler:
+    """
+    Agrupa tensores de varias peticiones en batches y los ejecuta con `run_batch`.
+
+    Args:
+        name: Nombre del modelo (clave en las estadísticas).
+        run_batch: Callable(batch) -> salida con la misma primera dimensión.
+        max_batch_size: Máximo de filas (slices) por batch.
+        max_wait_ms: Espera máxima desde la primera petición del batch.
+        concat: Función para concatenar entradas (np.concatenate, torch.cat, ...).
+        enabled: Si es False, `run` llama directamente a `run_batch`.
+    """
+
+    def __init__(self, name, run_batch, max_batch_size=32, max_wait_ms=5.0,
+                 concat=np.concatenate, enabled=BATCHING_ENABLED):
+        self.name           = name
+        self.run_batch      = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait       = max_wait_ms / 1000.0
+        self.concat         = concat
+        self.enabled        = enabled
+
+        self._queue   = queue.Queue()
+        self._pending = None  # petición que no cabía en el batch anterior
+        self._thread  = None
+        self._lock    = threading.Lock()
+
+        self._batch_sizes = Counter()
+        self._waits       = deque(maxlen=WAIT_SAMPLES)
+        self._n_requests  = 0
+        self._n_batches   = 0
+
+        SCHEDULERS[name] = self
+
+    # ——— API ———
+    def submit(self, x) -> Future:
+        """Encola un tensor (N, ...) y devuelve un Future con su salida (N, ...)."""
+        self._ensure_worker()
+        req = _Request(x)
+        self._queue.put(req)
+        return req.future
+
+    def run(self, x):
+        """Ejecuta `x` a través del planificador y espera el resultado."""
+        if not self.enabled:
+            return self.run_batch(x)
+        return self.submit(x).result()
+
+    # ——— Hilo de batching ———
+    def _ensure_worker(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._loop, name=f"batcher-{self.name}", daemon=True
+                )
+                self._thread.start()
+
+    def _collect(self):
+        first = self._pending or self._queue.get()
+        self._pending = None
+        batch, rows = [first], first.rows
+        deadline = first.enqueued + self.max_wait
+
+        while rows < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                req = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if rows + req.rows > self.max_batch_size:
+                self._pending = req
+                break
+            batch.append(req)
+            rows += req.rows
+        return batch, rows
+
+    def _loop(self):
+        while True:
+            batch, rows = self._collect()
+            started = time.perf_counter()
+            try:
+                x = batch[0].x if len(batch) == 1 else self.concat([r.x for r in batch])
+                out = self.run_batch(x)
+                offset = 0
+                for req in batch:
+                    req.future.set_result(out[offset:offset + req.rows])
+                    offset += req.rows
+            except Exception as e:
+                logger.error(f"Batch inference failed on '{self.name}': {e}")
+                for req in batch:
+                    if not req.future.done():
+                        req.future.set_exception(e)
+
+            with self._lock:
+                self._n_batches  += 1
+                self._n_requests += len(batch)
+                self._batch_sizes[rows] += 1
+                self._waits.extend(started - r.enqueued for r in batch)
+
+    # ——— Métricas ———
+    def stats(self) -> dict:
+        with self._lock:
+            waits = np.array(self._waits, dtype=np.float64) * 1000.0
+            histogram = sorted(self._batch_sizes.items())
+            n_requests, n_batches = self._n_requests, self._n_batches
+        return {
+            "enabled": self.enabled,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "queue_depth": self._queue.qsize() + (1 if self._pending else 0),
+            "requests": n_requests,
+            "batches": n_batches,
+            "batch_size_histogram": {str(k): v for k, v in histogram},
+            "wait_ms": {
+                "mean": float(waits.mean()) if waits.size else 0.0,
+                "p95": float(np.percentile(waits, 95)) if waits.size else 0.0,
+                "max": float(waits.max()) if waits.size else 0.0,
+            },
+        }
+
+
+def scheduler_stats() -> dict:
+    return {name: s.stats() for name, s in SCHEDULERS.items()}
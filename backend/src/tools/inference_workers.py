@@ -0,0 +1,226 @@
+"""
+inference_workers.py
+Procesos de inferencia aislados por framework.
+
+Con INFERENCE_MODE=workers el clasificador (PyTorch) y el segmentador
+(TensorFlow / onnxruntime) se ejecutan en subprocesos de larga duración, uno por
+framework. Las peticiones viajan por una cola IPC y los tensores (volúmenes,
+máscaras) por `multiprocessing.shared_memory`, sin serializarlos con pickle.
+Si un worker muere (crash, OOM) sus peticiones fallan con error y el proceso se
+relanza en la siguiente llamada, sin tumbar la API.
+"""
+
+import os
+import queue
+import threading
+import itertools
+import importlib
+import logging
+import multiprocessing as mp
+from concurrent.futures import Future
+from multiprocessing import shared_memory
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+INFERENCE_MODE = os.getenv("INFERENCE_MODE", "inline")  # inline | workers
+WORKER_TIMEOUT = float(os.getenv("INFERENCE_WORKER_TIMEOUT_S", "600"))
+POLL_INTERVAL  = 1.0
+
+# nombre -> (módulo, función que recibe y devuelve np.ndarray)
+WORKER_SPECS = {
+    "classifier": ("src.tools.execute_brain_tumor_classifier", "predict_probabilities_array"),
+    "segmenter":  ("src.tools.execute_brain_tumor_segmentation", "predict_volume"),
+}
+
+
+# ——— Transporte por memoria compartida ———
+def _share(arr: np.ndarray):
+    """Copia `arr` a un bloque de memoria compartida nuevo y devuelve (shm, descriptor)."""
+    arr = np.ascontiguousarray(arr)
+    shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+    np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[...] = arr
+    return shm, (shm.name, arr.shape, arr.dtype.str)
+
+
+def _attach(name: str):
+    """
+    Abre un bloque existente. Los workers comparten el resource_tracker del
+    proceso padre, así que cada bloque queda registrado una sola vez y se
+    libera con el `unlink` que hace siempre el padre.
+    """
+    return shared_memory.SharedMemory(name=name)
+
+
+def _release(shm, unlink: bool = False):
+    try:
+        shm.close()
+    except BufferError:
+        pass  # aún hay vistas vivas; el bloque se libera al recolectarlas
+    if unlink:
+        try:
+            shm.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def _worker_main(name, module_name, func_name, requests, responses):
+    """Bucle del subproceso: importa solo el framework de su modelo y atiende peticiones."""
+    logging.basicConfig(level=logging.INFO)
+    handler = getattr(importlib.import_module(module_name), func_name)
+    from src.tools.model_registry import MODEL_REGISTRY
+    MODEL_REGISTRY.preload()
+    logger.info(f"Inference worker '{name}' ready (pid {os.getpid()})")
+
+    while True:
+        msg = requests.get()
+        if msg is None:
+            break
+        req_id, (shm_name, shape, dtype) = msg
+        try:
+            shm_in = _attach(shm_name)
+            x = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm_in.buf)
+            out = np.asarray(handler(x))
+            del x
+            _release(shm_in)
+            shm_out, desc = _share(out)
+            _release(shm_out)
+            responses.put((req_id, desc, None))
+        except Exception as e:
+            logger.error(f"Inference worker '{name}' failed: {e}", exc_info=True)
+            responses.put((req_id, None, f"{type(e).__name__}: {e}"))
+
+
+class InferenceWorker:
+    """Un subproceso de inferencia con su cola de peticiones y su hilo despachador."""
+
+    def __init__(self, name, module_name, func_name, ctx=None):
+        self.name        = name
+        self.module_name = module_name
+        self.func_name   = func_name
+        self._ctx        = ctx or mp.get_context("spawn")
+        self._lock       = threading.Lock()
+        self._ids        = itertools.count()
+        self._pending    = {}  # req_id -> (Future, shm de entrada, generación del proceso)
+        self._generation = 0
+        self._process    = None
+        self._requests   = None
+        self._responses  = None
+        self.restarts    = 0
+
+    # ——— Ciclo de vida ———
+    def start(self):
+        with self._lock:
+            if self._process is not None and self._process.is_alive():
+                return
+            if self._process is not None:
+                self.restarts += 1
+            self._generation += 1
+            self._requests  = self._ctx.Queue()
+            self._responses = self._ctx.Queue()
+            self._process = self._ctx.Process(
+                target=_worker_main,
+                args=(self.name, self.module_name, self.func_name, self._requests, self._responses),
+                name=f"inference-{self.name}",
+                daemon=True,
+            )
+            self._process.start()
+            threading.Thread(
+                target=self._dispatch, args=(self._process, self._responses, self._generation),
+                name=f"dispatch-{self.name}", daemon=True,
+            ).start()
+            logger.info(f"Started inference worker '{self.name}' (pid {self._process.pid})")
+
+    def stop(self):
+        with self._lock:
+            if self._process is not None and self._process.is_alive():
+                self._requests.put(None)
+                self._process.join(timeout=10)
+                if self._process.is_alive():
+                    self._process.terminate()
+
+    # ——— Peticiones ———
+    def submit(self, x: np.ndarray) -> Future:
+        self.start()
+        shm, desc = _share(x)
+        future = Future()
+        with self._lock:
+            req_id = next(self._ids)
+            self._pending[req_id] = (future, shm, self._generation)
+            self._requests.put((req_id, desc))
+        return future
+
+    def run(self, x: np.ndarray, timeout: float = WORKER_TIMEOUT) -> np.ndarray:
+        return self.submit(x).result(timeout=timeout)
+
+    def _dispatch(self, process, responses, generation):
+        while True:
+            try:
+                req_id, desc, error = responses.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                if not process.is_alive():
+                    self._fail_pending(generation, f"Inference worker '{self.name}' died (exit code {process.exitcode})")
+                    return
+                continue
+            except (EOFError, OSError):
+                self._fail_pending(generation, f"Inference worker '{self.name}' connection lost")
+                return
+
+            with self._lock:
+                future, shm_in, _ = self._pending.pop(req_id, (None, None, None))
+            if shm_in is not None:
+                _release(shm_in, unlink=True)
+            if future is None:
+                continue
+            if error is not None:
+                future.set_exception(RuntimeError(error))
+                continue
+
+            shm_name, shape, dtype = desc
+            shm_out = _attach(shm_name)
+            out = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm_out.buf).copy()
+            _release(shm_out, unlink=True)
+            future.set_result(out)
+
+    def _fail_pending(self, generation, message):
+        """Falla las peticiones enviadas al proceso caído (no las del relanzado)."""
+        logger.error(message)
+        with self._lock:
+            lost = [k for k, (_, _, gen) in self._pending.items() if gen == generation]
+            pending = [self._pending.pop(k) for k in lost]
+        for future, shm_in, _ in pending:
+            _release(shm_in, unlink=True)
+            if not future.done():
+                future.set_exception(RuntimeError(message))
+
+    def stats(self) -> dict:
+        alive = self._process is not None and self._process.is_alive()
+        return {
+            "pid": self._process.pid if alive else None,
+            "alive": alive,
+            "pending": len(self._pending),
+            "restarts": self.restarts,
+        }
+
+
+class WorkerPool:
+    def __init__(self, specs):
+        self.workers = {name: InferenceWorker(name, *spec) for name, spec in specs.items()}
+
+    def run(self, name: str, x: np.ndarray) -> np.ndarray:
+        return self.workers[name].run(x)
+
+    def start_all(self):
+        for worker in self.workers.values():
+            worker.start()
+
+    def stop_all(self):
+        for worker in self.workers.values():
+            worker.stop()
+
+    def stats(self) -> dict:
+        return {name: w.stats() for name, w in self.workers.items()}
+
+
+WORKERS = WorkerPool(WORKER_SPECS)
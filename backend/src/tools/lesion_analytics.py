@@ -0,0 +1,98 @@
+"""
+lesion_analytics.py
+Medidas 3D de la lesión calculadas directamente de la máscara predicha.
+
+A partir de las etiquetas (n, 128, 128) de la U-Net (argmax de `p`) y de la
+cabecera del NIfTI (tamaño de vóxel y afín) se obtienen, en una sola pasada
+vectorizada:
+
+    · volumen por clase y total en cc (cada vóxel de la rejilla del modelo
+      cubre H/128 x W/128 vóxeles nativos en el plano y uno en z),
+    · componentes conexas del tumor (26-conectividad, descartando las de
+      menos de LESION_MIN_VOXELS vóxeles),
+    · centroide y caja englobante (vóxeles del volumen original y mm) y slice
+      axial con mayor área tumoral, sobre las componentes que superan el mínimo.
+
+Coste de milisegundos: el informe las usa sin otra ronda del LLM.
+"""
+
+import os
+
+import numpy as np
+from scipy import ndimage
+
+from src.tools.mask_encoding import MASK_CLASSES
+
+LESION_MIN_VOXELS = int(os.getenv("LESION_MIN_VOXELS", "10"))
+
+_STRUCTURE = ndimage.generate_binary_structure(3, 3)
+
+
+def _to_native(index, scale):
+    """Centro de la celda `index` de la rejilla del modelo en coordenadas de vóxel nativas."""
+    return (np.asarray(index, dtype=np.float64) + 0.5) * scale - 0.5
+
+
+def lesion_analytics(labels, info, start_slice: int = 0, classes=MASK_CLASSES,
+                     min_voxels: int = LESION_MIN_VOXELS) -> dict:
+    """
+    Args:
+        labels: Etiquetas (n, h, w) uint8 de los slices axiales [start_slice, start_slice + n).
+        info: VolumeInfo del NIfTI de origen (forma, spacing y afín).
+        start_slice: Primer slice axial del volumen cubierto por `labels`.
+
+    Returns:
+        dict JSON con volúmenes (cc), componentes, centroide, caja y slice de mayor área.
+    """
+    n, h, w = labels.shape
+    scale = np.array([info.shape[0] / h, info.shape[1] / w, 1.0])
+    voxel_mm3 = info.voxel_volume_mm3 * float(scale[0] * scale[1])
+    pixel_mm2 = voxel_mm3 / info.spacing[2]
+
+    counts = np.bincount(labels.ravel(), minlength=max(classes) + 1)
+    result = {
+        "voxel_volume_mm3": round(voxel_mm3, 4),
+        "classes": {
+            name: {"voxels": int(counts[cls]), "volume_cc": round(float(counts[cls]) * voxel_mm3 / 1000.0, 2)}
+            for cls, name in classes.items()
+        },
+    }
+    tumor = labels > 0
+    total = int(counts[1:].sum())
+    result["total_cc"] = round(total * voxel_mm3 / 1000.0, 2)
+    if total == 0:
+        result.update(components=0, largest_component_cc=0.0, centroid_voxel=None, centroid_mm=None,
+                      bbox_voxel=None, extent_mm=None, largest_slice=None, largest_slice_area_mm2=0.0)
+        return result
+
+    # componentes conexas: tamaños con bincount sobre las etiquetas de ndimage.label
+    components, n_components = ndimage.label(tumor, structure=_STRUCTURE)
+    sizes = np.bincount(components.ravel())[1:]
+    keep = np.zeros(n_components + 1, dtype=bool)
+    keep[1:] = sizes >= min_voxels
+    result["components"] = int(keep.sum())
+    result["largest_component_cc"] = round(int(sizes.max()) * voxel_mm3 / 1000.0, 2)
+    if keep.any():
+        tumor = keep[components]  # centroide, caja y áreas sin los vóxeles sueltos
+
+    # ejes de labels: (z, fila, columna) → vóxel nativo (fila, columna, z)
+    zs, rows, cols = np.nonzero(tumor)
+    grid = np.stack([rows, cols, zs + start_slice], axis=1)
+    lo, hi = grid.min(axis=0), grid.max(axis=0)
+    centroid = _to_native(grid.mean(axis=0), scale)
+    bbox_lo = np.floor(lo * scale).astype(int)
+    bbox_hi = np.ceil((hi + 1) * scale).astype(int) - 1
+    bbox_lo[2], bbox_hi[2] = lo[2], hi[2]
+
+    centroid_mm = (info.affine @ np.append(centroid, 1.0))[:3]
+    area = tumor.sum(axis=(1, 2))
+    largest = int(area.argmax())
+    result.update(
+        centroid_voxel=[round(float(c), 1) for c in centroid],
+        centroid_mm=[round(float(c), 1) for c in centroid_mm],
+        bbox_voxel=[[int(a), int(b)] for a, b in zip(bbox_lo, bbox_hi)],
+        extent_mm=[round(float((b - a + 1) * s), 1) for a, b, s in zip(bbox_lo, bbox_hi, info.spacing)],
+        largest_slice=start_slice + largest,
+        largest_slice_area_mm2=round(float(area[largest] * pixel_mm2), 1),
+    )
+    return result
@@ -0,0 +1,99 @@
+"""
+mask_encoding.py
+Codificaciones compactas de la máscara de segmentación para el frontend.
+
+La máscara (n, 128, 128) uint8 del segmentador se sirve en dos formatos para
+que el cliente dibuje y active/desactive cada clase sin imágenes renderizadas:
+
+    · RLE (JSON): por clase y por slice axial con tumor, longitudes de tramos
+      alternos fondo/clase sobre el slice aplanado en orden C (fila a fila),
+      empezando por fondo. Los slices sin la clase no aparecen.
+    · bits (binario): un bit por vóxel y clase (`np.packbits`, MSB primero)
+      precedido de una cabecera JSON; ver `pack_mask`.
+
+En ambos casos la rejilla es la del modelo (128x128 por slice, slices
+[start_slice, start_slice + n) del volumen); `volume_shape` indica la forma del
+NIfTI original para escalar en el cliente.
+"""
+
+import json
+import struct
+
+import numpy as np
+
+MASK_CLASSES = {1: "NECROTIC-CORE", 2: "EDEMA", 3: "ENHANCING"}
+
+
+def rle_counts(rows) -> list:
+    """
+    RLE de cada fila de `rows` (n, L) bool. Devuelve una lista de n arrays de
+    longitudes alternas (fondo, clase, fondo, ...) que suman L; None para las
+    filas vacías.
+    """
+    n, length = rows.shape
+    x = np.zeros((n, length + 1), dtype=np.int8)
+    x[:, 1:] = rows
+    r, pos = np.nonzero(np.diff(x, axis=1))
+    bounds = np.searchsorted(r, np.arange(n + 1))
+    out = [None] * n
+    for i in np.flatnonzero(np.diff(bounds)):
+        b = pos[bounds[i]:bounds[i + 1]]
+        out[i] = np.diff(np.concatenate(([0], b, [length])))
+    return out
+
+
+def rle_decode(counts, length: int) -> np.ndarray:
+    """Inversa de `rle_counts` para una fila: array bool de `length` elementos."""
+    counts = np.asarray(counts, dtype=np.int64)
+    values = np.arange(counts.size) % 2 == 1
+    row = np.repeat(values, counts)
+    if row.size != length:
+        raise ValueError(f"RLE covers {row.size} elements, expected {length}")
+    return row
+
+
+def encode_rle(mask, start_slice: int = 0, classes=MASK_CLASSES, volume_shape=None) -> dict:
+    """Máscara (n, h, w) → dict JSON con el RLE por clase y slice (clave = índice axial del volumen)."""
+    n, h, w = mask.shape
+    flat = mask.reshape(n, h * w)
+    encoded = {}
+    for cls, name in classes.items():
+        slices = {}
+        for i, counts in enumerate(rle_counts(flat == cls)):
+            if counts is not None:
+                slices[str(start_slice + i)] = counts.tolist()
+        encoded[str(cls)] = {"name": name, "slices": slices}
+    return {
+        "format": "rle",
+        "order": "C",
+        "shape": [n, h, w],
+        "start_slice": start_slice,
+        "volume_shape": list(volume_shape) if volume_shape is not None else None,
+        "classes": encoded,
+    }
+
+
+def pack_mask(mask, start_slice: int = 0, classes=MASK_CLASSES, volume_shape=None) -> bytes:
+    """
+    Máscara (n, h, w) → bytes: uint32 little-endian con la longitud de la
+    cabecera, la cabecera JSON (utf-8) y los bits de (clases, n, h, w) en orden C.
+    """
+    n, h, w = mask.shape
+    ids = np.array(list(classes), dtype=mask.dtype)
+    bits = np.packbits(mask[None] == ids[:, None, None, None])
+    header = json.dumps({
+        "format": "bits",
+        "bitorder": "big",
+        "order": "C",
+        "shape": [len(ids), n, h, w],
+        "classes": {str(c): name for c, name in classes.items()},
+        "start_slice": start_slice,
+        "volume_shape": list(volume_shape) if volume_shape is not None else None,
+    }).encode("utf-8")
+    return struct.pack("<I", len(header)) + header + bits.tobytes()
+
+
+def write_mask_rle(path: str, mask, start_slice: int = 0, volume_shape=None) -> str:
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(encode_rle(mask, start_slice, volume_shape=volume_shape), f, separators=(",", ":"))
+    return path
@@ -0,0 +1,257 @@
+"""
+model_registry.py
+Registro de modelos compartido por todo el proceso.
+
+Las herramientas de inferencia registran aquí su función de carga y piden el
+modelo con `MODEL_REGISTRY.get(...)` en lugar de recargarlo en cada llamada.
+Cada modelo se identifica por (tipo, rutas del checkpoint, mtime), de modo que
+si el fichero cambia en disco se vuelve a cargar automáticamente.
+
+Además:
+    · Presupuesto de memoria: si se supera, se expulsan los modelos menos usados.
+    · TTL de inactividad: los modelos que llevan demasiado sin usarse se liberan.
+    · `resident()` devuelve qué modelos están cargados (endpoint /models).
+"""
+
+import gc
+import os
+import threading
+import time
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+MODEL_MEMORY_BUDGET = int(os.getenv("MODEL_MEMORY_BUDGET_MB", "4096")) * 1024 * 1024
+MODEL_IDLE_TTL      = float(os.getenv("MODEL_IDLE_TTL_S", "1800"))  # 0 → sin expiración
+JANITOR_INTERVAL    = 60.0
+
+
+def estimate_model_bytes(model, paths=()) -> int:
+    """Estimación barata de la memoria que ocupa un modelo cargado."""
+    # PyTorch: parámetros + buffers
+    if hasattr(model, "parameters") and hasattr(model, "buffers"):
+        try:
+            tensors = list(model.parameters()) + list(model.buffers())
+            return int(sum(t.numel() * t.element_size() for t in tensors))
+        except Exception:
+            pass
+    # Keras: nº de parámetros en float32
+    if hasattr(model, "count_params"):
+        try:
+            return int(model.count_params()) * 4
+        except Exception:
+            pass
+    # Resto (sesiones ONNX, etc.): tamaño del checkpoint en disco
+    return int(sum(os.path.getsize(p) for p in paths if os.path.exists(p)))
+
+
+class _LoaderSpec:
+    def __init__(self, loader, default_paths, warmup, size_fn, preload):
+        self.loader        = loader
+        self.default_paths = tuple(default_paths)
+        self.warmup        = warmup
+        self.size_fn       = size_fn
+        self.preload       = preload
+
+
+class _Entry:
+    def __init__(self, kind, paths, model, nbytes, load_seconds):
+        self.kind         = kind
+        self.paths        = paths
+        self.model        = model
+        self.nbytes       = nbytes
+        self.load_seconds = load_seconds
+        self.loaded_at    = time.time()
+        self.last_used    = self.loaded_at
+        self.hits         = 0
+
+
+class ModelRegistry:
+    """Caché de modelos con presupuesto de memoria y expulsión por inactividad."""
+
+    def __init__(self, max_bytes: int = MODEL_MEMORY_BUDGET, idle_ttl: float = MODEL_IDLE_TTL):
+        self.max_bytes  = max_bytes
+        self.idle_ttl   = idle_ttl
+        self._specs     = {}             # kind -> _LoaderSpec
+        self._entries   = OrderedDict()  # key  -> _Entry (orden LRU)
+        self._load_locks = {}            # key  -> Lock (evita cargas duplicadas)
+        self._lock      = threading.RLock()
+        self._janitor   = None
+
+    # ——— Registro ———
+    def register(self, kind: str, loader, default_paths=(), warmup=None, size_fn=None,
+                 preload: bool = True):
+        """
+        Registra la función de carga de un tipo de modelo.
+
+        Args:
+            kind: Nombre del modelo ("classifier", "segmenter", ...).
+            loader: Callable(*paths) -> modelo.
+            default_paths: Rutas usadas por `get(kind)` y `preload()`.
+            warmup: Callable(modelo) que ejecuta una pasada de calentamiento.
+            size_fn: Callable(modelo) -> bytes; por defecto `estimate_model_bytes`.
+            preload: Si se carga en el arranque con `preload()`.
+        """
+        with self._lock:
+            self._specs[kind] = _LoaderSpec(loader, default_paths, warmup, size_fn, preload)
+
+    def registered(self, preload_only: bool = False):
+        with self._lock:
+            return [k for k, spec in self._specs.items() if spec.preload or not preload_only]
+
+    # ——— Acceso ———
+    @staticmethod
+    def _make_key(kind, paths):
+        stamp = []
+        for p in paths:
+            try:
+                stamp.append((os.path.abspath(p), os.stat(p).st_mtime_ns))
+            except OSError:
+                # el loader se encargará de lanzar el FileNotFoundError adecuado
+                stamp.append((os.path.abspath(p), None))
+        return (kind, tuple(stamp))
+
+    def get(self, kind: str, *paths, warmup: bool = False):
+        """Devuelve el modelo residente (o lo carga si no lo está)."""
+        with self._lock:
+            spec = self._specs.get(kind)
+        if spec is None:
+            raise KeyError(f"Model kind not registered: {kind}")
+        paths = tuple(paths) or spec.default_paths
+        key = self._make_key(kind, paths)
+
+        self.evict_idle()
+
+        with self._lock:
+            entry = self._touch(key)
+            if entry is not None:
+                return entry.model
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+
+        with load_lock:
+            with self._lock:
+                entry = self._touch(key)
+                if entry is not None:
+                    return entry.model
+
+            t0 = time.perf_counter()
+            model = spec.loader(*paths)
+            if warmup and spec.warmup is not None:
+                spec.warmup(model)
+            elapsed = time.perf_counter() - t0
+            nbytes = spec.size_fn(model) if spec.size_fn else estimate_model_bytes(model, paths)
+
+            with self._lock:
+                # si el checkpoint cambió en disco, la versión anterior sobra
+                for old_key in [k for k, e in self._entries.items()
+                                if e.kind == kind and e.paths == paths and k != key]:
+                    self._drop(old_key, reason="stale checkpoint")
+                self._entries[key] = _Entry(kind, paths, model, nbytes, elapsed)
+                self._load_locks.pop(key, None)
+                self._enforce_budget(keep=key)
+            logger.info(f"Model '{kind}' resident ({nbytes / 2**20:.1f} MiB, loaded in {elapsed:.2f}s)")
+            return model
+
+    def _touch(self, key):
+        entry = self._entries.get(key)
+        if entry is not None:
+            entry.last_used = time.time()
+            entry.hits += 1
+            self._entries.move_to_end(key)
+        return entry
+
+    # ——— Expulsión ———
+    def _drop(self, key, reason: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            logger.info(f"Evicting model '{entry.kind}' ({reason})")
+
+    def _enforce_budget(self, keep=None):
+        total = sum(e.nbytes for e in self._entries.values())
+        for key in list(self._entries):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            total -= self._entries[key].nbytes
+            self._drop(key, reason="memory budget")
+
+    def evict_idle(self) -> int:
+        """Libera los modelos que llevan más de `idle_ttl` segundos sin usarse."""
+        if not self.idle_ttl or self.idle_ttl <= 0:
+            return 0
+        now = time.time()
+        with self._lock:
+            expired = [k for k, e in self._entries.items() if now - e.last_used > self.idle_ttl]
+            for key in expired:
+                self._drop(key, reason="idle TTL")
+        if expired:
+            gc.collect()
+        return len(expired)
+
+    def evict(self, kind: str = None) -> int:
+        """Libera todos los modelos (o solo los de un tipo)."""
+        with self._lock:
+            keys = [k for k, e in self._entries.items() if kind is None or e.kind == kind]
+            for key in keys:
+                self._drop(key, reason="manual")
+        gc.collect()
+        return len(keys)
+
+    def start_janitor(self, interval: float = JANITOR_INTERVAL):
+        """Hilo en segundo plano que aplica el TTL de inactividad."""
+        if self._janitor is not None and self._janitor.is_alive():
+            return
+
+        def _loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.evict_idle()
+                except Exception as e:
+                    logger.error(f"Model janitor error: {e}")
+
+        self._janitor = threading.Thread(target=_loop, name="model-registry-janitor", daemon=True)
+        self._janitor.start()
+
+    # ——— Precarga ———
+    def preload(self, kinds=None) -> dict:
+        """Carga y calienta los modelos registrados. Devuelve {kind: "ok" | error}."""
+        status = {}
+        for kind in kinds or self.registered(preload_only=True):
+            try:
+                self.get(kind, warmup=True)
+                status[kind] = "ok"
+            except Exception as e:
+                logger.error(f"Preload of model '{kind}' failed: {e}")
+                status[kind] = str(e)
+        return status
+
+    # ——— Introspección ———
+    def resident(self) -> list:
+        now = time.time()
+        with self._lock:
+            return [
+                {
+                    "kind": e.kind,
+                    "paths": list(e.paths),
+                    "bytes": e.nbytes,
+                    "load_seconds": round(e.load_seconds, 3),
+                    "idle_seconds": round(now - e.last_used, 1),
+                    "hits": e.hits,
+                }
+                for e in self._entries.values()
+            ]
+
+    def stats(self) -> dict:
+        resident = self.resident()
+        return {
+            "resident": resident,
+            "resident_bytes": sum(e["bytes"] for e in resident),
+            "budget_bytes": self.max_bytes,
+            "idle_ttl_seconds": self.idle_ttl,
+        }
+
+
+MODEL_REGISTRY = ModelRegistry()
@@ -0,0 +1,142 @@
+"""
+onnx_runtime_backend.py
+Exportación de modelos a ONNX y ejecución con onnxruntime (CPUExecutionProvider).
+
+Uso (desde backend/):
+    python -m src.tools.onnx_runtime_backend export-classifier [--int8]
+    python -m src.tools.onnx_runtime_backend export-segmenter
+
+La conversión de la U-Net llama directamente a `tf2onnx.convert.from_keras`
+(`model.export(format="onnx")` de Keras ignora el opset), así que necesita
+`tf2onnx` en el entorno donde se convierte (no en el de inferencia).
+"""
+
+import os
+import argparse
+import logging
+
+import numpy as np
+import onnxruntime as ort
+
+logger = logging.getLogger(__name__)
+
+ONNX_INTRA_OP_THREADS = int(os.getenv("ONNX_INTRA_OP_THREADS", "0"))  # 0 → lo decide ORT
+ONNX_OPSET            = 17
+
+CLASSIFIER_ONNX_PATH      = "data/models/brain_tumor_classifier_v3.onnx"
+CLASSIFIER_ONNX_INT8_PATH = "data/models/brain_tumor_classifier_v3.int8.onnx"
+SEGMENTER_ONNX_PATH       = "data/models/brain_tumor_segmentation.onnx"
+IMG_SIZE = 128
+
+
+# ——— Sesiones ———
+def create_session(onnx_path: str, intra_op_threads: int = ONNX_INTRA_OP_THREADS):
+    """Crea una InferenceSession en CPU con optimizaciones de grafo completas."""
+    if not os.path.exists(onnx_path):
+        raise FileNotFoundError(f"ONNX model not found at {onnx_path}")
+    opts = ort.SessionOptions()
+    opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    opts.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    opts.inter_op_num_threads = 1
+    if intra_op_threads:
+        opts.intra_op_num_threads = intra_op_threads
+    session = ort.InferenceSession(onnx_path, sess_options=opts,
+                                   providers=["CPUExecutionProvider"])
+    logger.info(f"ONNX session created from {onnx_path}")
+    return session
+
+
+def run_session(session, x: np.ndarray) -> np.ndarray:
+    """Ejecuta la sesión con una única entrada y devuelve la primera salida."""
+    name = session.get_inputs()[0].name
+    return session.run(None, {name: np.ascontiguousarray(x, dtype=np.float32)})[0]
+
+
+def softmax(logits: np.ndarray) -> np.ndarray:
+    e = np.exp(logits - logits.max(axis=1, keepdims=True))
+    return e / e.sum(axis=1, keepdims=True)
+
+
+def warmup_classifier_session(session):
+    run_session(session, np.zeros((1, 2, IMG_SIZE, IMG_SIZE), dtype=np.float32))
+
+
+# ——— Exportación ———
+def export_classifier_to_onnx(model, onnx_path: str = CLASSIFIER_ONNX_PATH, opset: int = ONNX_OPSET):
+    """
+    Exporta el clasificador PyTorch (ya cargado, sea modelo completo o desde
+    `model_state`/`state_dict`) a ONNX con batch dinámico.
+    """
+    import torch
+
+    model = model.to("cpu").eval()
+    dummy = torch.zeros(1, 2, IMG_SIZE, IMG_SIZE)
+    os.makedirs(os.path.dirname(os.path.abspath(onnx_path)), exist_ok=True)
+    torch.onnx.export(
+        model, dummy, onnx_path,
+        input_names=["input"], output_names=["logits"],
+        dynamic_axes={"input": {0: "batch"}, "logits": {0: "batch"}},
+        opset_version=opset,
+        dynamo=False,
+    )
+    logger.info(f"Classifier exported to {onnx_path}")
+    return onnx_path
+
+
+def export_segmenter_to_onnx(model, onnx_path: str = SEGMENTER_ONNX_PATH, opset: int = ONNX_OPSET):
+    """
+    Convierte la U-Net de Keras (arquitectura .h5 + pesos ya cargados) a ONNX
+    con entrada (batch,128,128,2) float32.
+    """
+    import tensorflow as tf
+    import tf2onnx
+
+    os.makedirs(os.path.dirname(os.path.abspath(onnx_path)), exist_ok=True)
+    signature = [tf.TensorSpec((None, IMG_SIZE, IMG_SIZE, 2), tf.float32, name="input")]
+    tf2onnx.convert.from_keras(model, input_signature=signature, opset=opset, output_path=onnx_path)
+    logger.info(f"Segmenter exported to {onnx_path}")
+    return onnx_path
+
+
+def quantize_onnx_int8(onnx_path: str, out_path: str) -> str:
+    """Cuantización dinámica int8 de los pesos (las activaciones se cuantizan en ejecución)."""
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    quantize_dynamic(onnx_path, out_path, weight_type=QuantType.QInt8)
+    logger.info(f"Quantized int8 model written to {out_path}")
+    return out_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Exporta los modelos a ONNX")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    cls = sub.add_parser("export-classifier", help="DenseNet-121 (.pkl) → ONNX")
+    cls.add_argument("--model", default=None, help="Checkpoint PyTorch (por defecto MODEL_PATH)")
+    cls.add_argument("--out", default=CLASSIFIER_ONNX_PATH)
+    cls.add_argument("--int8", action="store_true", help="Genera también la variante int8")
+    cls.add_argument("--int8-out", default=CLASSIFIER_ONNX_INT8_PATH)
+
+    seg = sub.add_parser("export-segmenter", help="U-Net Keras (.h5 + pesos) → ONNX")
+    seg.add_argument("--model", default=None, help="Arquitectura .h5 (por defecto MODEL_PATH)")
+    seg.add_argument("--weights", default=None, help="Pesos .weights.h5 (por defecto WEIGHTS_PATH)")
+    seg.add_argument("--out", default=SEGMENTER_ONNX_PATH)
+
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == "export-classifier":
+        from src.tools.execute_brain_tumor_classifier import load_model, MODEL_PATH
+        model = load_model(args.model or MODEL_PATH)
+        export_classifier_to_onnx(model, args.out)
+        if args.int8:
+            quantize_onnx_int8(args.out, args.int8_out)
+
+    elif args.command == "export-segmenter":
+        from src.tools.execute_brain_tumor_segmentation import load_model, MODEL_PATH, WEIGHTS_PATH
+        model = load_model(args.model or MODEL_PATH, args.weights or WEIGHTS_PATH)
+        export_segmenter_to_onnx(model, args.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -22,6 +22,61 @@ from reportlab.platypus import Table, TableStyle, Image as RLImage, ListFlowable
 from reportlab.lib.colors import HexColor
 from reportlab.pdfgen import canvas
 from reportlab.lib.utils import ImageReader
+from src.tools.scan_catalog import normalize_patient
+
+SEGMENTATION_JSON = "data/temp/segmentation.json"
+NO_DISPONIBLE     = (None, "", "NO DISPONIBLE")
+
+
+def lesion_for_report(data: dict, segmentation_path: str = SEGMENTATION_JSON):
+    """
+    Analítica de la lesión (ver lesion_analytics.py) de uno de los scans del
+    informe. Solo se usan entradas de segmentation.json del mismo paciente y
+    cuyo `scan_id` esté en `data["scans"]` (un segmentation.json de otro
+    paciente nunca llega al PDF): la del mismo `mask_file` o, si no, la de
+    mayor volumen. Sin entradas válidas se calcula de la máscara en caché de
+    esos scans. None si no hay ninguna.
+    """
+    scans = [s for s in data.get("scans") or [] if isinstance(s, dict) and s.get("scan_id")]
+    scan_ids = {s["scan_id"] for s in scans}
+    patient = normalize_patient(str(data.get("paciente_id") or ""))
+    if not scan_ids or not patient:
+        return None
+
+    try:
+        with open(segmentation_path, "r", encoding="utf-8") as f:
+            segmentation = json.load(f)
+        entries = segmentation.get("data/segmentations") or []
+        same_patient = normalize_patient(str(segmentation.get("patient_identifier") or "")) == patient
+    except (OSError, ValueError, AttributeError):
+        entries, same_patient = [], False
+    lesions = [e for e in entries if same_patient and isinstance(e, dict)
+               and e.get("lesion") and e.get("scan_id") in scan_ids]
+    for entry in lesions:
+        if data.get("mask_file") not in NO_DISPONIBLE and entry.get("mask_file") == data["mask_file"]:
+            return entry["lesion"]
+    candidates = [e["lesion"] for e in lesions]
+
+    if not candidates:
+        from src.tools.execute_brain_tumor_segmentation import lesion_from_cache
+        for scan in scans:
+            paths = (scan.get("flair_path"), scan.get("t1ce_path"))
+            if all(p and os.path.isfile(p) for p in paths):
+                lesion = lesion_from_cache(*paths)
+                if lesion is not None:
+                    candidates.append(lesion)
+    return max(candidates, key=lambda l: l["total_cc"], default=None)
+
+
+def lesion_location(lesion: dict) -> str:
+    """Zona afectada descrita con el centroide (mm) y la caja englobante (vóxeles) de la máscara."""
+    if not lesion.get("total_cc") or lesion.get("centroid_mm") is None:
+        return "Sin lesión detectada en la máscara"
+    centroid = ", ".join(str(c) for c in lesion["centroid_mm"])
+    (r0, r1), (c0, c1), (z0, z1) = lesion["bbox_voxel"]
+    return (f"centroide ({centroid}) mm · caja englobante filas {r0}-{r1}, columnas {c0}-{c1}, "
+            f"slices axiales {z0}-{z1}")
+
 
 # ---------------------------------------------------------------------
 # 1 · TOOL: genera el PDF a partir de data/temp/report.json
@@ -40,6 +95,15 @@ def generate_pdf_from_report(report_json_path: str,
         with open(report_json_path, "r", encoding="utf-8") as f:
             data = json.load(f)
 
+        # volumen y medidas de la lesión calculados de la máscara, no copiados por el LLM
+        try:
+            lesion = lesion_for_report(data)
+        except Exception:
+            lesion = None  # el PDF se genera igual, sin el desglose de la lesión
+        if lesion is not None:
+            data["volumen_cc"]    = lesion["total_cc"]
+            data["zona_afectada"] = lesion_location(lesion)
+
         os.makedirs(output_folder, exist_ok=True)
         pdf_name = f"{data.get('paciente_id','paciente')}_{data.get('fecha','')}.pdf"
         pdf_path = os.path.join(output_folder, pdf_name)
@@ -222,10 +286,19 @@ def generate_pdf_from_report(report_json_path: str,
 
         # Segmentación
         E.append(Paragraph("<b>Segmentación de imagen</b>", styles["Heading2"]))
+        lesion_lines = ""
+        if lesion is not None and lesion["total_cc"] > 0:
+            por_clase = " · ".join(f"{name.lower()} {c['volume_cc']} cc" for name, c in lesion["classes"].items())
+            lesion_lines = (
+                f"Volumen por clase: {por_clase}<br/>"
+                f"Lesiones (componentes conexas): {lesion['components']} · "
+                f"slice con mayor área: {lesion['largest_slice']} ({lesion['largest_slice_area_mm2']} mm²)<br/>"
+                f"Extensión: {' x '.join(str(e) for e in lesion['extent_mm'])} mm<br/>"
+            )
         seg = f"""
         Zona afectada: {data.get('zona_afectada','NO DISPONIBLE')}<br/>
         Volumen estimado: {data.get('volumen_cc','NO DISPONIBLE')} cc<br/>
-        Slice seleccionada: {data.get('slice','NO DISPONIBLE')} <br/>
+        {lesion_lines}Slice seleccionada: {data.get('slice','NO DISPONIBLE')} <br/>
         Imagen cerebral: {data.get('input_slice','NO DISPONIBLE')}<br/>
         Segmentacion del tumor: {data.get('mask_file','NO DISPONIBLE')}<br/>
         Máscara superpuesta: {data.get('overlay_file','NO DISPONIBLE')}
@@ -0,0 +1,25 @@
+"""
+request_context.py
+Propagación de los `contextvars` de la petición a los hilos de las herramientas.
+
+strands (0.1.x) ejecuta cada llamada a herramienta en el ThreadPoolExecutor
+del Agent sin copiar el contexto, así que un ContextVar fijado en /query (p. ej.
+el umbral de la puerta de segmentación) no llegaría a la herramienta. Este
+wrapper envuelve cada tarea en `contextvars.copy_context().run`.
+"""
+
+import contextvars
+
+from strands.tools import ThreadPoolExecutorWrapper
+
+
+class ContextThreadPoolWrapper(ThreadPoolExecutorWrapper):
+    def submit(self, fn, /, *args, **kwargs):
+        return self.thread_pool.submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
+def propagate_context(agent):
+    """Hace que las herramientas del `agent` se ejecuten con el contexto de quien lo llama."""
+    if getattr(agent, "thread_pool", None) is not None:
+        agent.thread_pool_wrapper = ContextThreadPoolWrapper(agent.thread_pool)
+    return agent
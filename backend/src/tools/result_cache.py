@@ -0,0 +1,238 @@
+"""
+result_cache.py
+Caché de resultados de inferencia direccionada por contenido.
+
+La clave de cada entrada es el sha256 del par FLAIR + T1CE (contenido, no
+ruta) más la versión del modelo (backend, checkpoint y parámetros que cambian
+la salida). Si los `.nii` no cambian, repetir un paciente no vuelve a
+decodificar volúmenes ni a ejecutar los modelos.
+
+Estructura en disco (RESULT_CACHE_DIR):
+    <espacio>/<kk>/<clave>.json   resultados JSON (clasificación, rutas de PNGs)
+    <espacio>/<kk>/<clave>.npz    arrays comprimidos (máscara 3D, probabilidades)
+
+El tamaño total está acotado por RESULT_CACHE_BUDGET_MB; al superarse se
+expulsan las entradas usadas hace más tiempo (el mtime de cada fichero se
+actualiza en cada acierto y hace de marca LRU entre reinicios). El `.json` y
+el `.npz` de una misma clave se tratan como una unidad: un acierto refresca
+ambos y se expulsan juntos, para no dejar un JSON cuya máscara ya no existe.
+"""
+
+import os
+import io
+import json
+import hashlib
+import threading
+import logging
+from collections import OrderedDict
+
+import numpy as np
+
+from src.tools.volume_cache import file_signature
+
+logger = logging.getLogger(__name__)
+
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE", "1") == "1"
+RESULT_CACHE_DIR     = os.getenv("RESULT_CACHE_DIR", "data/cache/results")
+RESULT_CACHE_BUDGET  = int(os.getenv("RESULT_CACHE_BUDGET_MB", "2048")) * 1024 * 1024
+HASH_CHUNK           = 4 * 1024 * 1024
+
+
+# ——— Hash de contenido ———
+_digest_lock = threading.Lock()
+_digests = {}  # (ruta absoluta, mtime_ns, tamaño) -> sha256
+
+
+def file_digest(path: str) -> str:
+    """sha256 del fichero, memorizado mientras no cambien su mtime ni su tamaño."""
+    sig = file_signature(path)
+    with _digest_lock:
+        digest = _digests.get(sig)
+    if digest is not None:
+        return digest
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b""):
+            h.update(chunk)
+    digest = h.hexdigest()
+    register_digest(path, digest)
+    return digest
+
+
+def register_digest(path: str, digest: str):
+    """Registra un hash ya calculado (p. ej. durante una subida) para no releer el fichero."""
+    sig = file_signature(path)
+    with _digest_lock:
+        for stale in [k for k in _digests if k[0] == sig[0] and k != sig]:
+            del _digests[stale]
+        _digests[sig] = digest
+
+
+def model_version(*parts, paths=()) -> str:
+    """Identificador de versión: parámetros + (nombre, tamaño, mtime) de cada checkpoint."""
+    items = [str(p) for p in parts]
+    for path in paths:
+        if os.path.exists(path):
+            st = os.stat(path)
+            items.append(f"{os.path.basename(path)}:{st.st_size}:{st.st_mtime_ns}")
+        else:
+            items.append(f"{os.path.basename(path)}:missing")
+    return "|".join(items)
+
+
+def pair_key(flair_path: str, t1ce_path: str, version: str) -> str:
+    h = hashlib.sha256()
+    for part in (file_digest(flair_path), file_digest(t1ce_path), version):
+        h.update(part.encode())
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+# ——— Caché en disco con LRU ———
+class ResultCache:
+    def __init__(self, root: str = RESULT_CACHE_DIR, budget_bytes: int = RESULT_CACHE_BUDGET,
+                 enabled: bool = RESULT_CACHE_ENABLED):
+        self.root     = root
+        self.budget   = budget_bytes
+        self.enabled  = enabled
+        self._lock    = threading.Lock()
+        self._index   = None  # ruta -> tamaño, de menos a más reciente
+        self._bytes   = 0
+        self.hits     = 0
+        self.misses   = 0
+        self.evictions = 0
+
+    def _path(self, namespace, key, ext):
+        return os.path.join(self.root, namespace, key[:2], f"{key}.{ext}")
+
+    def _load_index(self):
+        """Reconstruye el índice LRU recorriendo el directorio (una vez por proceso)."""
+        if self._index is not None:
+            return
+        entries = []
+        for dirpath, _, files in os.walk(self.root):
+            for name in files:
+                if name.endswith((".json", ".npz")):
+                    path = os.path.join(dirpath, name)
+                    st = os.stat(path)
+                    entries.append((st.st_mtime_ns, path, st.st_size))
+        entries.sort()
+        self._index = OrderedDict((path, size) for _, path, size in entries)
+        self._bytes = sum(self._index.values())
+
+    @staticmethod
+    def _siblings(path):
+        """Ficheros de la misma clave (`.json` y `.npz`)."""
+        stem = os.path.splitext(path)[0]
+        return [stem + ".json", stem + ".npz"]
+
+    def _touch(self, path):
+        with self._lock:
+            self._load_index()
+            siblings = [p for p in self._siblings(path) if p in self._index]
+            for p in siblings:
+                self._index.move_to_end(p)
+        for p in siblings or [path]:
+            try:
+                os.utime(p)
+            except OSError:
+                pass
+
+    def _write(self, path, data: bytes):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+        with self._lock:
+            self._load_index()
+            self._bytes -= self._index.pop(path, 0)
+            self._index[path] = len(data)
+            self._bytes += len(data)
+            self._evict_locked()
+
+    def _evict_locked(self):
+        while self._bytes > self.budget and len(self._index) > 1:
+            oldest = next(iter(self._index))
+            size = 0
+            for path in self._siblings(oldest):
+                if path not in self._index:
+                    continue
+                size += self._index.pop(path)
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            self._bytes -= size
+            self.evictions += 1
+            logger.info(f"Result cache evicted {os.path.splitext(os.path.basename(oldest))[0]} "
+                        f"({size / 1e6:.1f} MB)")
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    # ——— JSON ———
+    def get_json(self, namespace: str, key: str):
+        if not self.enabled:
+            return None
+        path = self._path(namespace, key, "json")
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                value = json.load(f)
+        except (OSError, ValueError):
+            self._count(False)
+            return None
+        self._touch(path)
+        self._count(True)
+        return value
+
+    def put_json(self, namespace: str, key: str, value):
+        if self.enabled:
+            self._write(self._path(namespace, key, "json"), json.dumps(value).encode("utf-8"))
+
+    # ——— Arrays ———
+    def get_arrays(self, namespace: str, key: str, names=None):
+        """dict nombre -> ndarray (solo `names` si se indica), o None si no está en caché."""
+        if not self.enabled:
+            return None
+        path = self._path(namespace, key, "npz")
+        try:
+            with np.load(path) as npz:
+                arrays = {name: npz[name] for name in (names or npz.files)}
+        except (OSError, ValueError, KeyError):
+            self._count(False)
+            return None
+        self._touch(path)
+        self._count(True)
+        return arrays
+
+    def has_arrays(self, namespace: str, key: str) -> bool:
+        return self.enabled and os.path.isfile(self._path(namespace, key, "npz"))
+
+    def put_arrays(self, namespace: str, key: str, **arrays):
+        if self.enabled:
+            buf = io.BytesIO()
+            np.savez_compressed(buf, **arrays)
+            self._write(self._path(namespace, key, "npz"), buf.getvalue())
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._load_index()
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._index),
+                "bytes": self._bytes,
+                "budget_bytes": self.budget,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+            }
+
+
+RESULT_CACHE = ResultCache()
@@ -0,0 +1,259 @@
+"""
+scan_catalog.py
+Catálogo determinista paciente → scans de data/pictures/.
+
+Los volúmenes siguen la convención `<paciente>_<n>_{flair,t1ce}.nii(.gz)`, así
+que localizar los pares de un paciente es un problema de parseo de nombres,
+no de un LLM. El catálogo:
+
+    · parsea cada nombre una sola vez y agrupa por paciente y número de scan,
+    · se persiste en CATALOG_PATH junto con el mtime del directorio: al
+      arrancar, si el directorio no ha cambiado no se vuelve a listar,
+    · se actualiza de forma incremental con `update(path)` (subidas y eventos
+      de watchdog), que anota el nuevo mtime del directorio; en cada consulta
+      solo relista si el mtime cambió por otra vía (ficheros copiados a mano),
+    · agrupa las escrituras del índice a disco: como mucho una cada
+      CATALOG_SAVE_INTERVAL segundos, y las pendientes en la siguiente consulta,
+    · usa los mismos scan_id que `volume_reader.scan_id_from_path` (mayúsculas
+      y ceros a la izquierda incluidos) y responde con el formato de `lister.json`.
+"""
+
+import os
+import re
+import json
+import time
+import threading
+import logging
+
+from src.tools.scan_ingestion import INGESTION_DIR
+from src.tools.volume_reader import scan_id_from_path
+
+logger = logging.getLogger(__name__)
+
+CATALOG_DIR    = INGESTION_DIR
+CATALOG_PATH   = os.getenv("SCAN_CATALOG_PATH", "data/cache/scan_catalog.json")
+LISTER_OUTPUT  = "data/temp/lister.json"
+CATALOG_SAVE_INTERVAL = float(os.getenv("SCAN_CATALOG_SAVE_INTERVAL", "5"))
+
+SCAN_NAME_RE = re.compile(r"^(?P<patient>.+)_(?P<n>\d+)_(?P<modality>flair|t1ce)\.nii(?P<gz>\.gz)?$",
+                          re.IGNORECASE)
+
+
+def normalize_patient(identifier: str) -> str:
+    """`Carlos Pérez` / `carlos-perez` / ` CARLOS_PEREZ ` → `carlos_perez` (sin tocar acentos)."""
+    return re.sub(r"[\s\-]+", "_", identifier.strip().lower()).strip("_")
+
+
+def parse_scan_name(name: str):
+    """(paciente normalizado, scan_id, modalidad, comprimido) o None si el nombre no sigue la convención."""
+    m = SCAN_NAME_RE.match(name)
+    if m is None:
+        return None
+    return normalize_patient(m["patient"]), scan_id_from_path(name), m["modality"].lower(), bool(m["gz"])
+
+
+def _scan_order(scan_id: str):
+    # `<paciente>_<n>`: orden numérico por n (`_2` antes que `_10`)
+    return int(scan_id.rsplit("_", 1)[1]), scan_id
+
+
+class ScanCatalog:
+    def __init__(self, directory: str = CATALOG_DIR, index_path: str = CATALOG_PATH):
+        self.directory  = directory
+        self.index_path = index_path
+        self._lock      = threading.Lock()
+        self._files     = {}    # nombre de fichero -> (paciente, scan_id, modalidad, comprimido)
+        self._patients  = {}    # paciente -> {scan_id: {modalidad: nombre}}
+        self._dir_mtime = None
+        self._loaded    = False
+        self._dirty     = False
+        self._synced    = False  # el índice refleja el directorio en `_dir_mtime`
+        self._saved_at  = 0.0
+        self.rescans    = 0
+        self.updates    = 0
+
+    # ——— Índice en memoria ———
+    def _add(self, name):
+        parsed = parse_scan_name(name)
+        if parsed is None:
+            return False
+        patient, scan_id, modality, gz = parsed
+        slot = self._patients.setdefault(patient, {}).setdefault(scan_id, {})
+        current = slot.get(modality)
+        # con .nii y .nii.gz del mismo scan manda el comprimido (como find_pair)
+        if current is None or gz or not self._files[current][3]:
+            slot[modality] = name
+        self._files[name] = parsed
+        return True
+
+    def _remove(self, name):
+        parsed = self._files.pop(name, None)
+        if parsed is None:
+            return False
+        patient, scan_id, modality, _ = parsed
+        scans = self._patients.get(patient, {})
+        slot = scans.get(scan_id, {})
+        if slot.get(modality) == name:
+            del slot[modality]
+            for other, p in self._files.items():  # la otra extensión, si existía
+                if p[:3] == parsed[:3]:
+                    slot[modality] = other
+                    break
+        if not slot:
+            scans.pop(scan_id, None)
+        if not scans:
+            self._patients.pop(patient, None)
+        return True
+
+    def _rebuild(self, names):
+        self._files, self._patients = {}, {}
+        for name in sorted(names):
+            self._add(name)
+
+    # ——— Persistencia ———
+    def _dir_mtime_ns(self):
+        try:
+            return os.stat(self.directory).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _load_locked(self):
+        self._loaded = True
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return
+        if saved.get("directory") == os.path.abspath(self.directory):
+            self._rebuild(saved.get("files", []))
+            self._dir_mtime = saved.get("dir_mtime_ns")
+
+    def _save_locked(self, force: bool = False):
+        """Escribe el índice, o lo deja pendiente si la última escritura es muy reciente."""
+        if not force and time.monotonic() - self._saved_at < CATALOG_SAVE_INTERVAL:
+            self._dirty = True
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.index_path)), exist_ok=True)
+        tmp = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"directory": os.path.abspath(self.directory), "dir_mtime_ns": self._dir_mtime,
+                       "files": sorted(self._files)}, f)
+        os.replace(tmp, self.index_path)
+        self._dirty, self._saved_at = False, time.monotonic()
+
+    def _refresh_locked(self):
+        """Relista el directorio solo si su mtime cambió desde la última vez."""
+        if not self._loaded:
+            self._load_locked()
+        mtime = self._dir_mtime_ns()
+        if mtime is not None and mtime == self._dir_mtime:
+            self._synced = True
+            if self._dirty:
+                self._save_locked(force=True)
+            return
+        names = []
+        if mtime is not None:
+            with os.scandir(self.directory) as it:
+                names = [e.name for e in it if e.is_file()]
+        self._rebuild(names)
+        self._dir_mtime = mtime
+        self._synced = True
+        self.rescans += 1
+        self._save_locked(force=True)
+        logger.info(f"Scan catalog: indexed {len(self._files)} file(s), {len(self._patients)} patient(s)")
+
+    def refresh(self):
+        with self._lock:
+            self._refresh_locked()
+
+    def flush(self):
+        """Escribe a disco el índice si quedó alguna actualización pendiente."""
+        with self._lock:
+            if self._dirty:
+                self._save_locked(force=True)
+
+    def update(self, path: str):
+        """Alta o baja de un fichero (subida o evento de watchdog) sin relistar."""
+        if os.path.dirname(os.path.abspath(path)) != os.path.abspath(self.directory):
+            return
+        name = os.path.basename(path)
+        with self._lock:
+            if not self._loaded:
+                self._load_locked()
+            exists = os.path.isfile(path)
+            if exists == (name in self._files):
+                return  # reescritura de un fichero ya indexado: el índice no cambia
+            changed = self._add(name) if exists else self._remove(name)
+            if self._synced:
+                # el alta/baja es el cambio del directorio: su nuevo mtime evita relistar
+                self._dir_mtime = self._dir_mtime_ns()
+            if changed:
+                self.updates += 1
+            self._save_locked()
+
+    # ——— Consultas ———
+    def _scan_entry(self, scan_id, slot):
+        return {
+            "scan_id": scan_id,
+            "flair_path": os.path.join(self.directory, slot["flair"]),
+            "t1ce_path": os.path.join(self.directory, slot["t1ce"]),
+        }
+
+    def _complete(self, patient):
+        scans = self._patients.get(patient, {})
+        return [self._scan_entry(scan_id, scans[scan_id]) for scan_id in sorted(scans, key=_scan_order)
+                if "flair" in scans[scan_id] and "t1ce" in scans[scan_id]]
+
+    def lookup(self, patient_identifier: str) -> dict:
+        """
+        Pares completos FLAIR/T1CE del paciente en formato `lister.json`. Si no
+        hay coincidencia exacta se aceptan los pacientes cuyo nombre empieza por
+        el identificador (p. ej. faltan apellidos), siempre que sea uno solo.
+        """
+        patient = normalize_patient(patient_identifier)
+        with self._lock:
+            self._refresh_locked()
+            if patient not in self._patients:
+                matches = sorted(p for p in self._patients if p.startswith(patient + "_"))
+                if len(matches) > 1:
+                    return {"patient_identifier": patient, "scans": [], "candidates": matches,
+                            "error": "Identificador ambiguo: coincide con varios pacientes."}
+                if matches:
+                    patient = matches[0]
+            scans = self._complete(patient)
+        result = {"patient_identifier": patient, "scans": scans}
+        if not scans:
+            result["error"] = "No se encontraron pares de imágenes (flair/t1ce) completos."
+        return result
+
+    def pair(self, scan_id: str):
+        """(flair_path, t1ce_path) del scan `<paciente>_<n>`, o None si no está completo."""
+        m = re.match(r"^(?P<patient>.+)_\d+$", scan_id)
+        if m is None:
+            return None
+        with self._lock:
+            self._refresh_locked()
+            slot = self._patients.get(normalize_patient(m["patient"]), {}).get(scan_id, {})
+            if "flair" not in slot or "t1ce" not in slot:
+                return None
+            return (os.path.join(self.directory, slot["flair"]),
+                    os.path.join(self.directory, slot["t1ce"]))
+
+    def patients(self) -> dict:
+        """paciente -> lista de scans completos."""
+        with self._lock:
+            self._refresh_locked()
+            return {p: self._complete(p) for p in sorted(self._patients)}
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "directory": self.directory,
+                "files": len(self._files),
+                "patients": len(self._patients),
+                "rescans": self.rescans,
+                "updates": self.updates,
+            }
+
+
+SCAN_CATALOG = ScanCatalog()
@@ -0,0 +1,246 @@
+"""
+scan_ingestion.py
+Ingesta en segundo plano de los scans que aparecen en data/pictures/.
+
+Un observador de `watchdog` detecta pares FLAIR/T1CE nuevos o modificados y,
+tras esperar a que los ficheros dejen de cambiar (copias en curso), un hilo:
+
+    1. valida el par (cabeceras NIfTI legibles, volúmenes 3D de igual forma),
+    2. construye el tensor pre-procesado (tensor_store),
+    3. clasifica el par en los modos configurados (result_cache),
+    4. opcionalmente lo segmenta (SCAN_INGESTION_SEGMENT=1).
+
+Todo queda en las cachés, así que cuando se pregunta por el paciente las
+herramientas responden sin repetir el trabajo caro. Al arrancar se encolan
+también los pares ya existentes (lo que ya esté en caché cuesta un hash).
+"""
+
+import os
+import re
+import time
+import threading
+import logging
+
+from src.tools.volume_reader import NIFTI_SUFFIXES, scan_id_from_path, volume_info
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:  # sin watchdog solo se procesa lo que llegue por `notify`
+    Observer, FileSystemEventHandler = None, object
+
+logger = logging.getLogger(__name__)
+
+INGESTION_ENABLED  = os.getenv("SCAN_INGESTION", "1") == "1"
+INGESTION_DIR      = os.getenv("SCAN_INGESTION_DIR", "data/pictures")
+INGESTION_MODES    = [m for m in os.getenv("SCAN_INGESTION_MODES", "volume,slice").split(",") if m]
+INGESTION_SEGMENT  = os.getenv("SCAN_INGESTION_SEGMENT", "0") == "1"
+INGESTION_DEBOUNCE = float(os.getenv("SCAN_INGESTION_DEBOUNCE_S", "2"))
+
+SCAN_FILE_RE = re.compile(r"_(flair|t1ce)\.nii(\.gz)?$", re.IGNORECASE)
+
+
+def find_pair(directory: str, scan_id: str):
+    """(flair_path, t1ce_path) del scan en `directory`, o None si falta alguno."""
+    paths = []
+    for modality in ("flair", "t1ce"):
+        found = None
+        for suffix in NIFTI_SUFFIXES:
+            for name in (f"{scan_id}_{modality}{suffix}", f"{scan_id}_{modality.upper()}{suffix}"):
+                candidate = os.path.join(directory, name)
+                if os.path.isfile(candidate):
+                    found = candidate
+                    break
+            if found:
+                break
+        if found is None:
+            return None
+        paths.append(found)
+    return tuple(paths)
+
+
+def validate_pair(flair_path: str, t1ce_path: str):
+    """Lanza ValueError si el par no es utilizable por los modelos."""
+    flair, t1ce = volume_info(flair_path), volume_info(t1ce_path)
+    if len(flair.shape) != 3 or len(t1ce.shape) != 3:
+        raise ValueError(f"Expected 3D volumes, got {flair.shape} and {t1ce.shape}")
+    if flair.shape != t1ce.shape:
+        raise ValueError(f"FLAIR {flair.shape} and T1CE {t1ce.shape} shapes differ")
+
+
+class _Handler(FileSystemEventHandler):
+    """
+    Solo eventos de escritura: creación, renombrado y cierre tras escribir.
+    Los `opened`/`closed_no_write` que watchdog emite en cada lectura (la propia
+    ingesta, las herramientas o los tiles abren los NIfTI) no re-encolan el scan.
+    """
+
+    def __init__(self, service):
+        self.service = service
+
+    def on_created(self, event):
+        if not event.is_directory:
+            self.service.notify(event.src_path)
+
+    def on_closed(self, event):  # IN_CLOSE_WRITE
+        if not event.is_directory:
+            self.service.notify(event.src_path)
+
+    def on_moved(self, event):
+        if event.is_directory:
+            return
+        from src.tools.scan_catalog import SCAN_CATALOG
+        SCAN_CATALOG.update(event.src_path)
+        self.service.notify(event.dest_path)
+
+    def on_deleted(self, event):
+        if not event.is_directory:
+            from src.tools.scan_catalog import SCAN_CATALOG
+            SCAN_CATALOG.update(event.src_path)
+
+
+class ScanIngestionService:
+    def __init__(self, directory: str = INGESTION_DIR, modes=INGESTION_MODES,
+                 segment: bool = INGESTION_SEGMENT, debounce: float = INGESTION_DEBOUNCE):
+        self.directory = directory
+        self.modes     = list(modes)
+        self.segment   = segment
+        self.debounce  = debounce
+        self._lock     = threading.Lock()
+        self._wakeup   = threading.Event()
+        self._pending  = {}  # scan_id -> instante del último evento
+        self._status   = {}  # scan_id -> dict de estado
+        self._observer = None
+        self._thread   = None
+        self._stop     = False
+        self.processed = 0
+        self.failed    = 0
+
+    # ——— Eventos ———
+    def notify(self, path: str):
+        """Registra `path` en el catálogo y encola su scan (llamado por watchdog o por la subida)."""
+        if not SCAN_FILE_RE.search(os.path.basename(path)):
+            return
+        from src.tools.scan_catalog import SCAN_CATALOG
+        SCAN_CATALOG.update(path)
+        scan_id = scan_id_from_path(path)
+        with self._lock:
+            self._pending[scan_id] = time.monotonic()
+            self._status.setdefault(scan_id, {})["status"] = "pending"
+        self._wakeup.set()
+
+    def enqueue_existing(self):
+        if not os.path.isdir(self.directory):
+            return
+        for name in sorted(os.listdir(self.directory)):
+            self.notify(os.path.join(self.directory, name))
+
+    # ——— Ciclo de vida ———
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop = False
+        self._thread = threading.Thread(target=self._loop, name="scan-ingestion", daemon=True)
+        self._thread.start()
+        if Observer is None:
+            logger.warning("watchdog not installed: scan ingestion only handles uploads")
+        else:
+            os.makedirs(self.directory, exist_ok=True)
+            self._observer = Observer()
+            self._observer.schedule(_Handler(self), self.directory, recursive=False)
+            self._observer.start()
+            logger.info(f"Watching {self.directory} for new scans")
+        self.enqueue_existing()
+
+    def stop(self):
+        self._stop = True
+        self._wakeup.set()
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join(timeout=5)
+            self._observer = None
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    # ——— Procesado ———
+    def _due(self):
+        """Scans cuyo último evento es más antiguo que la ventana de espera."""
+        now = time.monotonic()
+        with self._lock:
+            ready = [s for s, t in self._pending.items() if now - t >= self.debounce]
+            for scan_id in ready:
+                del self._pending[scan_id]
+            wait = min((self.debounce - (now - t) for t in self._pending.values()), default=None)
+        return ready, wait
+
+    def _loop(self):
+        while not self._stop:
+            ready, wait = self._due()
+            for scan_id in ready:
+                self._ingest(scan_id)
+            if not ready:
+                self._wakeup.wait(timeout=wait)
+                self._wakeup.clear()
+
+    def _set_status(self, scan_id, **fields):
+        with self._lock:
+            self._status.setdefault(scan_id, {}).update(fields)
+
+    def _ingest(self, scan_id):
+        pair = find_pair(self.directory, scan_id)
+        if pair is None:
+            self._set_status(scan_id, status="incomplete")  # falta la otra modalidad
+            return
+        flair_path, t1ce_path = pair
+        t0 = time.perf_counter()
+        try:
+            validate_pair(flair_path, t1ce_path)
+
+            from src.tools.tensor_store import TENSOR_STORE
+            from src.tools.execute_brain_tumor_classifier import classify_scan
+            if TENSOR_STORE.enabled:
+                TENSOR_STORE.get(flair_path, t1ce_path)
+
+            result = {}
+            for mode in self.modes:
+                result[mode] = classify_scan(flair_path, t1ce_path, mode=mode)
+            p_tumor = (result.get("volume") or {}).get("p_tumor")
+
+            segmentation = None
+            if self.segment:
+                from src.tools.execute_brain_tumor_segmentation import segment_scan
+                segmentation = segment_scan(flair_path, t1ce_path, p_tumor=p_tumor)
+
+            seconds = round(time.perf_counter() - t0, 2)
+            self._set_status(scan_id, status="ready", flair_path=flair_path, t1ce_path=t1ce_path,
+                             p_tumor=p_tumor, segmented=bool(segmentation and not segmentation.get("skipped")),
+                             seconds=seconds, error=None)
+            with self._lock:
+                self.processed += 1
+            logger.info(f"Ingested {scan_id} in {seconds}s (p_tumor={p_tumor})")
+        except Exception as e:
+            self._set_status(scan_id, status="failed", error=str(e))
+            with self._lock:
+                self.failed += 1
+            logger.error(f"Ingestion of {scan_id} failed: {e}", exc_info=True)
+
+    def status(self, scan_id: str = None):
+        with self._lock:
+            if scan_id is not None:
+                return dict(self._status.get(scan_id, {"status": "unknown"}))
+            return {k: dict(v) for k, v in self._status.items()}
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": INGESTION_ENABLED,
+                "watching": self._observer is not None,
+                "directory": self.directory,
+                "pending": len(self._pending),
+                "processed": self.processed,
+                "failed": self.failed,
+            }
+
+
+SCAN_INGESTION = ScanIngestionService()
@@ -0,0 +1,206 @@
+"""
+scan_upload.py
+Subida de volúmenes NIfTI por streaming (multipart/form-data).
+
+El cuerpo de la petición se procesa según llega (`request.stream()`) con el
+parser incremental de python-multipart: cada fichero se escribe a disco en
+bloques de UPLOAD_CHUNK bytes y su sha256 se calcula sobre la marcha, de modo
+que la memoria no depende del tamaño del volumen. Cada parte se valida
+(cabecera NIfTI) al terminar de llegar, pero ninguna se publica en
+data/pictures/ hasta que todas son válidas: entonces se mueven con
+`os.replace` atómicos y, si una falla, no queda medio par publicado. El
+nombre original del fichero se conserva (mismo scan_id que una copia a mano)
+y el hash se registra en la caché de resultados para no volver a leer el fichero.
+"""
+
+import os
+import gzip
+import uuid
+import hashlib
+import logging
+
+import numpy as np
+import nibabel as nib
+from python_multipart.multipart import MultipartParser, parse_options_header
+from starlette.concurrency import run_in_threadpool
+
+from src.tools.result_cache import register_digest
+from src.tools.scan_ingestion import SCAN_FILE_RE
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_DIR       = os.getenv("SCAN_UPLOAD_DIR", "data/pictures")
+UPLOAD_CHUNK     = 1024 * 1024
+UPLOAD_MAX_BYTES = int(os.getenv("SCAN_UPLOAD_MAX_MB", "2048")) * 1024 * 1024
+
+
+class UploadError(ValueError):
+    def __init__(self, message, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def validate_nifti(path: str, filename: str):
+    """Comprueba la cabecera NIfTI-1 y que el fichero contenga todos los vóxeles que declara."""
+    opener = gzip.open if filename.lower().endswith(".gz") else open
+    try:
+        with opener(path, "rb") as f:
+            header = nib.Nifti1Header.from_fileobj(f, check=True)
+    except Exception as e:
+        raise UploadError(f"{filename}: invalid NIfTI header ({e})")
+    shape = header.get_data_shape()
+    if len(shape) != 3:
+        raise UploadError(f"{filename}: expected a 3D volume, got shape {shape}")
+    if not filename.lower().endswith(".gz"):
+        expected = int(header.get_data_offset()) + int(np.prod(shape)) * header.get_data_dtype().itemsize
+        if os.path.getsize(path) < expected:
+            raise UploadError(f"{filename}: truncated volume ({os.path.getsize(path)} < {expected} bytes)")
+    return tuple(int(d) for d in shape)
+
+
+class _Part:
+    def __init__(self, filename, directory):
+        self.filename = filename
+        self.tmp_path = os.path.join(directory, f".upload-{uuid.uuid4().hex}.part")
+        self.file     = open(self.tmp_path, "wb")
+        self.sha256   = hashlib.sha256()
+        self.buffer   = bytearray()
+        self.size     = 0
+        self.shape    = None
+
+
+class StreamingNiftiUpload:
+    """
+    Un upload en curso. Uso:
+
+        upload = StreamingNiftiUpload(content_type)
+        async for chunk in request.stream():
+            await upload.feed(chunk)
+        files = await upload.finish()
+    """
+
+    def __init__(self, content_type: str, directory: str = UPLOAD_DIR, max_bytes: int = UPLOAD_MAX_BYTES):
+        ctype, options = parse_options_header(content_type or "")
+        if ctype != b"multipart/form-data" or b"boundary" not in options:
+            raise UploadError("Expected multipart/form-data with a boundary")
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.received  = 0
+        self._part     = None
+        self._headers  = {}
+        self._field    = b""
+        self._value    = b""
+        self._done     = []    # partes cerradas pendientes de validar
+        self._valid    = []    # partes validadas pendientes de publicar
+        self.files     = []
+        os.makedirs(directory, exist_ok=True)
+        self._parser = MultipartParser(options[b"boundary"], {
+            "on_part_begin":       self._on_part_begin,
+            "on_header_field":     self._on_header_field,
+            "on_header_value":     self._on_header_value,
+            "on_header_end":       self._on_header_end,
+            "on_headers_finished": self._on_headers_finished,
+            "on_part_data":        self._on_part_data,
+            "on_part_end":         self._on_part_end,
+        })
+
+    # ——— Callbacks del parser (síncronos, sin E/S) ———
+    def _on_part_begin(self):
+        self._headers, self._field, self._value = {}, b"", b""
+
+    def _on_header_field(self, data, start, end):
+        self._field += data[start:end]
+
+    def _on_header_value(self, data, start, end):
+        self._value += data[start:end]
+
+    def _on_header_end(self):
+        self._headers[self._field.lower()] = self._value
+        self._field, self._value = b"", b""
+
+    def _on_headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        filename = os.path.basename(options.get(b"filename", b"").decode("utf-8", "replace"))
+        if not filename:
+            return  # campo de formulario normal: se ignora
+        if not SCAN_FILE_RE.search(filename):
+            raise UploadError(f"{filename}: expected <scan_id>_flair.nii(.gz) or <scan_id>_t1ce.nii(.gz)")
+        self._part = _Part(filename, self.directory)
+
+    def _on_part_data(self, data, start, end):
+        if self._part is not None:
+            self._part.buffer += data[start:end]
+
+    def _on_part_end(self):
+        if self._part is not None:
+            self._done.append(self._part)
+            self._part = None
+
+    # ——— E/S en el pool de hilos ———
+    @staticmethod
+    def _flush(part):
+        data = bytes(part.buffer)
+        part.buffer.clear()
+        part.sha256.update(data)
+        part.file.write(data)
+        part.size += len(data)
+
+    def _validate(self, part):
+        self._flush(part)
+        part.file.close()
+        try:
+            part.shape = validate_nifti(part.tmp_path, part.filename)
+        except UploadError:
+            os.remove(part.tmp_path)
+            raise
+        return part
+
+    def _publish(self, parts):
+        """Publica las partes ya validadas; solo se llama cuando todas lo están."""
+        files = []
+        for part in parts:
+            final_path = os.path.join(self.directory, part.filename)
+            os.replace(part.tmp_path, final_path)
+            digest = part.sha256.hexdigest()
+            register_digest(final_path, digest)
+            logger.info(f"Uploaded {final_path} ({part.size / 1e6:.1f} MB, sha256 {digest[:12]})")
+            files.append({"filename": part.filename, "path": final_path, "bytes": part.size,
+                          "sha256": digest, "shape": list(part.shape)})
+        return files
+
+    async def _validate_done(self):
+        while self._done:
+            part = self._done.pop(0)
+            self._valid.append(await run_in_threadpool(self._validate, part))
+
+    async def feed(self, chunk: bytes):
+        self.received += len(chunk)
+        if self.received > self.max_bytes:
+            raise UploadError(f"Upload exceeds {self.max_bytes // (1024 * 1024)} MB", status_code=413)
+        self._parser.write(chunk)
+        if self._part is not None and len(self._part.buffer) >= UPLOAD_CHUNK:
+            await run_in_threadpool(self._flush, self._part)
+        await self._validate_done()
+
+    async def finish(self):
+        self._parser.finalize()
+        await self._validate_done()
+        if self._part is not None:
+            raise UploadError("Multipart body ended in the middle of a file")
+        if not self._valid:
+            raise UploadError("No NIfTI files in upload")
+        parts, self._valid = self._valid, []
+        self.files = await run_in_threadpool(self._publish, parts)
+        return self.files
+
+    def abort(self):
+        """Borra los temporales de las partes no publicadas."""
+        for part in [self._part, *self._done, *self._valid]:
+            if part is None:
+                continue
+            try:
+                part.file.close()
+                os.remove(part.tmp_path)
+            except OSError:
+                pass
+        self._part, self._done, self._valid = None, [], []
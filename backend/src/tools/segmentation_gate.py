@@ -0,0 +1,120 @@
+"""
+segmentation_gate.py
+Decisión determinista de segmentar o no un scan según su probabilidad de tumor.
+
+La U-Net (y el render de PNGs) es la etapa más cara del flujo. Antes de
+ejecutarla, la herramienta de segmentación consulta esta puerta:
+
+    · p_tumor se toma del argumento de la llamada, de la clasificación del par
+      en RESULT_CACHE (direccionada por contenido y versión del modelo, así que
+      no sirve un resultado de otra versión del scan) o, si no existe, de una
+      pasada del clasificador en modo volumen.
+    · Si p_tumor < umbral, la segmentación se omite y se devuelve un resultado
+      marcado como `skipped`.
+
+El umbral por defecto sale de SEGMENTATION_THRESHOLD y puede fijarse por
+petición (campo `segmentation_threshold` de /query), que manda sobre el
+argumento `threshold` de las herramientas. El umbral de petición vive en un
+ContextVar: peticiones concurrentes no se pisan, y llega a los hilos de las
+herramientas a través de `request_context.propagate_context`.
+"""
+
+import os
+import threading
+import logging
+import contextvars
+from contextlib import contextmanager
+
+from src.tools.volume_reader import scan_id_from_path
+
+logger = logging.getLogger(__name__)
+
+SEGMENTATION_GATE_ENABLED = os.getenv("SEGMENTATION_GATE", "1") == "1"
+SEGMENTATION_THRESHOLD    = float(os.getenv("SEGMENTATION_THRESHOLD", "0.5"))
+
+_request_threshold = contextvars.ContextVar("segmentation_threshold", default=None)
+
+
+def _p_tumor_of(result):
+    if not isinstance(result, dict):
+        return None
+    if "p_tumor" in result:
+        return float(result["p_tumor"])
+    probs = result.get("probabilities") or {}
+    return float(probs["Tumor"]) if "Tumor" in probs else None
+
+
+class SegmentationGate:
+    """Política umbral → segmentar / omitir, con contadores para /inference/stats."""
+
+    def __init__(self, threshold: float = SEGMENTATION_THRESHOLD, enabled: bool = SEGMENTATION_GATE_ENABLED):
+        self.threshold = threshold
+        self.enabled   = enabled
+        self._lock     = threading.Lock()
+        self._counts   = {"evaluated": 0, "segmented": 0, "skipped": 0}
+        self._sources  = {}
+
+    @contextmanager
+    def request_threshold(self, threshold=None):
+        """Fija el umbral en el contexto de la petición actual (None → umbral por defecto)."""
+        token = _request_threshold.set(threshold)
+        try:
+            yield
+        finally:
+            _request_threshold.reset(token)
+
+    def current_threshold(self, threshold=None) -> float:
+        """Umbral de la petición /query, si lo hay; si no, el de la llamada o el por defecto."""
+        for value in (_request_threshold.get(), threshold):
+            if value is not None:
+                return float(value)
+        return self.threshold
+
+    def _resolve_p_tumor(self, flair_path, t1ce_path, p_tumor):
+        if p_tumor is not None:
+            return float(p_tumor), "argument"
+        from src.tools.execute_brain_tumor_classifier import cached_classification, classify_scan
+        # clasificación ya hecha de este mismo contenido (la de volumen es más robusta)
+        for mode in ("volume", "slice"):
+            p_tumor = _p_tumor_of(cached_classification(flair_path, t1ce_path, mode))
+            if p_tumor is not None:
+                return p_tumor, f"result_cache:{mode}"
+        # sin resultado previo: una pasada del clasificador en modo volumen
+        return float(classify_scan(flair_path, t1ce_path, mode="volume")["p_tumor"]), "classifier"
+
+    def decide(self, flair_path, t1ce_path, p_tumor=None, threshold=None) -> dict:
+        """
+        Returns:
+            dict con `segment` (bool), `scan_id`, `p_tumor`, `threshold` y `source`.
+        """
+        scan_id = scan_id_from_path(flair_path)
+        threshold = self.current_threshold(threshold)
+        if not self.enabled:
+            return {"segment": True, "scan_id": scan_id, "p_tumor": p_tumor,
+                    "threshold": threshold, "source": "disabled"}
+
+        p_tumor, source = self._resolve_p_tumor(flair_path, t1ce_path, p_tumor)
+        segment = p_tumor >= threshold
+        with self._lock:
+            self._counts["evaluated"] += 1
+            self._counts["segmented" if segment else "skipped"] += 1
+            self._sources[source] = self._sources.get(source, 0) + 1
+        logger.info(f"Segmentation gate {scan_id}: p_tumor={p_tumor:.3f} "
+                    f"threshold={threshold:.2f} → {'segment' if segment else 'skip'} ({source})")
+        return {"segment": segment, "scan_id": scan_id, "p_tumor": p_tumor,
+                "threshold": threshold, "source": source}
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts = dict(self._counts)
+            sources = dict(self._sources)
+        return {
+            "enabled": self.enabled,
+            "threshold": self.current_threshold(),
+            **counts,
+            "skip_rate": counts["skipped"] / counts["evaluated"] if counts["evaluated"] else 0.0,
+            "p_tumor_source": sources,
+        }
+
+
+SEGMENTATION_GATE = SegmentationGate()
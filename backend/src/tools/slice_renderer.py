@@ -0,0 +1,65 @@
+"""
+slice_renderer.py
+Render de slices y máscaras sin matplotlib.
+
+Las imágenes se componen directamente en NumPy (escala de grises + colores
+de la paleta de clases) y se codifican con Pillow. No hay estado global de
+pyplot, así que el render es seguro entre hilos y no deja figuras abiertas.
+"""
+
+import io
+
+import cv2
+import numpy as np
+from PIL import Image
+
+OVERLAY_ALPHA = 0.3    # opacidad de la máscara sobre el slice
+PNG_COMPRESS  = 1      # zlib rápido: PNGs algo mayores, codificación mucho más rápida
+
+
+def to_gray(slice2d) -> np.ndarray:
+    """Slice 2-D → uint8 con estiramiento min-max (como imshow(cmap='gray'))."""
+    s = np.asarray(slice2d, dtype=np.float32)
+    lo, hi = float(s.min()), float(s.max())
+    if hi <= lo:
+        return np.zeros(s.shape, dtype=np.uint8)
+    return ((s - lo) * (255.0 / (hi - lo))).astype(np.uint8)
+
+
+def upscale(img, size, nearest: bool = False) -> np.ndarray:
+    """Redimensiona a `size` x `size` o a `size` = (alto, ancho)."""
+    h, w = (size, size) if np.isscalar(size) else size
+    interpolation = cv2.INTER_NEAREST if nearest else cv2.INTER_CUBIC
+    return cv2.resize(img, (w, h), interpolation=interpolation)
+
+
+def overlay_labels(gray, labels, palette, alpha: float = OVERLAY_ALPHA) -> np.ndarray:
+    """Mezcla las clases > 0 de `labels` (uint8, mismo tamaño) con sus colores de `palette`."""
+    rgb = np.repeat(gray[:, :, None], 3, axis=2).astype(np.float32)
+    tumor = labels > 0
+    rgb[tumor] = (1.0 - alpha) * rgb[tumor] + alpha * palette[labels[tumor]]
+    return rgb.astype(np.uint8)
+
+
+def overlay_probability(gray, prob, color, alpha: float = OVERLAY_ALPHA) -> np.ndarray:
+    """Tinte del color de la clase proporcional a su probabilidad (0-1) en cada píxel."""
+    rgb = np.repeat(gray[:, :, None], 3, axis=2).astype(np.float32)
+    a = (alpha * np.clip(prob, 0.0, 1.0))[:, :, None]
+    rgb = (1.0 - a) * rgb + a * np.asarray(color, dtype=np.float32)
+    return rgb.astype(np.uint8)
+
+
+def encode(img, fmt: str = "png") -> bytes:
+    """Codifica un array uint8 (H, W) o (H, W, 3) como PNG o WebP."""
+    buf = io.BytesIO()
+    if fmt == "webp":
+        Image.fromarray(img).save(buf, format="WEBP", quality=90, method=2)
+    else:
+        Image.fromarray(img).save(buf, format="PNG", compress_level=PNG_COMPRESS)
+    return buf.getvalue()
+
+
+def save_png(img, path: str) -> str:
+    with open(path, "wb") as f:
+        f.write(encode(img, "png"))
+    return path
@@ -0,0 +1,204 @@
+"""
+slice_tiles.py
+Render bajo demanda de cualquier slice de un scan, con superposición opcional.
+
+En lugar de pre-renderizar PNGs fijos, cada petición pide un plano (axial,
+coronal o sagital) y un índice. El plano se lee del NIfTI a través de
+VOLUME_CACHE (`read_plane`), la máscara de clases sale del `.npz` que el
+segmentador guarda en RESULT_CACHE y la imagen se compone con slice_renderer.
+
+Las imágenes codificadas (PNG o WebP) se guardan en un LRU acotado en bytes.
+La clave incluye la firma de los ficheros de origen y la clave de la máscara:
+si el scan o el modelo cambian, las entradas antiguas dejan de usarse y
+acaban expulsadas.
+"""
+
+import os
+import threading
+import logging
+from collections import OrderedDict
+
+import numpy as np
+
+from src.tools.volume_cache import file_signature
+from src.tools.volume_reader import PLANE_AXES, read_plane, volume_info
+from src.tools.slice_renderer import to_gray, upscale, overlay_labels, encode
+
+logger = logging.getLogger(__name__)
+
+TILE_CACHE_BUDGET = int(os.getenv("SLICE_TILE_CACHE_MB", "64")) * 1024 * 1024
+TILE_SIZE         = int(os.getenv("SLICE_TILE_SIZE", "512"))   # lado mayor de la imagen
+TILE_MAX_SIZE     = 2048
+TILE_FORMATS      = {"png": "image/png", "webp": "image/webp"}
+TILE_MODALITIES   = ("flair", "t1ce")
+
+
+class TileError(ValueError):
+    def __init__(self, message, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class TileCache:
+    """LRU por bytes de imágenes ya codificadas."""
+
+    def __init__(self, budget_bytes: int = TILE_CACHE_BUDGET):
+        self.budget    = budget_bytes
+        self._lock     = threading.Lock()
+        self._entries  = OrderedDict()  # clave -> bytes
+        self._bytes    = 0
+        self.hits      = 0
+        self.misses    = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            data = self._entries.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def put(self, key, data: bytes):
+        if len(data) > self.budget:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= len(self._entries.pop(key))
+            self._entries[key] = data
+            self._bytes += len(data)
+            while self._bytes > self.budget:
+                _, old = self._entries.popitem(last=False)
+                self._bytes -= len(old)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "budget_bytes": self.budget,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+            }
+
+
+TILE_CACHE = TileCache()
+
+
+# ——— Máscara del segmentador en la rejilla original ———
+def _grid(n_native, n_model):
+    """Índice de la rejilla del modelo (n_model) para cada vóxel nativo (centros alineados)."""
+    return np.minimum(((np.arange(n_native) + 0.5) * n_model / n_native).astype(np.intp), n_model - 1)
+
+
+def plane_labels(mask, shape, plane: str, index: int, start: int) -> np.ndarray:
+    """
+    Etiquetas uint8 del plano pedido en la rejilla del NIfTI (mismo tamaño que
+    `read_plane`) a partir de la máscara (n, 128, 128) de los slices axiales
+    [start, start + n). Fuera de esa ventana la etiqueta es 0.
+    """
+    n, size_r, size_c = mask.shape
+    rows, cols = _grid(shape[0], size_r), _grid(shape[1], size_c)
+    stop = min(start + n, shape[2])
+    if plane == "axial":
+        if not start <= index < stop:
+            return np.zeros(shape[:2], dtype=np.uint8)
+        return mask[index - start][np.ix_(rows, cols)]
+
+    if plane == "coronal":
+        window = mask[:, rows, cols[index]]      # (n, H)
+    else:
+        window = mask[:, rows[index], cols]      # (n, W)
+    labels = np.zeros((window.shape[1], shape[2]), dtype=np.uint8)
+    labels[:, start:stop] = window[:stop - start].T
+    return labels
+
+
+def _segmentation_key(flair_path, t1ce_path):
+    from src.tools.execute_brain_tumor_segmentation import segmentation_key
+    return segmentation_key(flair_path, t1ce_path)
+
+
+def _segmentation_mask(key):
+    """Máscara (n, 128, 128) en caché, o TileError 404 si el scan no está segmentado."""
+    from src.tools.execute_brain_tumor_segmentation import cached_mask
+    mask = cached_mask(key)
+    if mask is None:
+        raise TileError("Scan has not been segmented yet", status_code=404)
+    return mask
+
+
+def _orient(img, plane):
+    """Axial tal cual (como los PNGs del segmentador); coronal/sagital con el eje superior arriba."""
+    if plane == "axial":
+        return img
+    return np.ascontiguousarray(np.rot90(img))
+
+
+def _tile_shape(shape2d, size):
+    h, w = shape2d
+    scale = size / max(h, w)
+    return max(1, round(h * scale)), max(1, round(w * scale))
+
+
+def render_tile(flair_path: str, t1ce_path: str, plane: str, index: int, modality: str = "flair",
+                overlay: bool = False, fmt: str = "png", size: int = TILE_SIZE):
+    """
+    Imagen codificada de un plano del scan.
+
+    Args:
+        plane: "axial", "coronal" o "sagittal".
+        index: Índice del plano en el volumen original.
+        modality: "flair" o "t1ce" como imagen de fondo.
+        overlay: Superpone las clases de la segmentación (debe estar en caché).
+        fmt: "png" o "webp".
+        size: Lado mayor de la imagen en píxeles.
+
+    Returns:
+        (bytes, media_type)
+    """
+    if plane not in PLANE_AXES:
+        raise TileError(f"Unknown plane {plane!r}; expected one of {sorted(PLANE_AXES)}")
+    if modality not in TILE_MODALITIES:
+        raise TileError(f"Unknown modality {modality!r}; expected one of {list(TILE_MODALITIES)}")
+    if fmt not in TILE_FORMATS:
+        raise TileError(f"Unknown format {fmt!r}; expected one of {sorted(TILE_FORMATS)}")
+    if not 16 <= size <= TILE_MAX_SIZE:
+        raise TileError(f"size must be between 16 and {TILE_MAX_SIZE}")
+
+    path = flair_path if modality == "flair" else t1ce_path
+    mask_key = _segmentation_key(flair_path, t1ce_path) if overlay else None
+    key = (file_signature(path), mask_key, plane, index, fmt, size)
+    data = TILE_CACHE.get(key)
+    if data is not None:
+        return data, TILE_FORMATS[fmt]
+
+    shape = volume_info(path).shape
+    try:
+        base = read_plane(path, plane, index)
+    except IndexError as e:
+        raise TileError(str(e), status_code=404)
+
+    gray = _orient(to_gray(base), plane)
+    out_shape = _tile_shape(gray.shape, size)
+    img = upscale(gray, out_shape)
+    if overlay:
+        from src.tools.execute_brain_tumor_segmentation import PALETTE, VOLUME_START_AT
+        mask = _segmentation_mask(mask_key)
+        labels = _orient(plane_labels(mask, shape, plane, index, VOLUME_START_AT), plane)
+        img = overlay_labels(img, upscale(labels, out_shape, nearest=True), PALETTE)
+
+    data = encode(img, fmt)
+    TILE_CACHE.put(key, data)
+    return data, TILE_FORMATS[fmt]
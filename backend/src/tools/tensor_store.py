@@ -0,0 +1,128 @@
+"""
+tensor_store.py
+Almacén persistente de volúmenes ya pre-procesados.
+
+Por cada scan se guarda en TENSOR_STORE_DIR (junto a data/pictures) un
+`.npy` float16 (profundidad, 128, 128, 2) con todos los slices axiales
+redimensionados y divididos por el máximo del volumen completo, más un `.json`
+con la firma (ruta, mtime, tamaño) de los ficheros de origen. Si el origen
+cambia, el tensor se reconstruye en el siguiente acceso.
+
+Los tensores se abren con `np.load(mmap_mode="r")`: las entradas de ambos
+modelos se obtienen leyendo del page cache y re-normalizando la ventana
+(ver `window_from_tensor` / `slices_from_tensor`), sin volver a redimensionar.
+Solo se mantienen abiertos los TENSOR_STORE_MAX_OPEN memmaps usados más
+recientemente; el resto se suelta (se cierra al no quedar referencias).
+"""
+
+import os
+import json
+import hashlib
+import threading
+import logging
+from collections import OrderedDict
+
+import numpy as np
+
+from src.tools.volume_cache import file_signature
+from src.tools.volume_reader import read_slab, scan_id_from_path
+from src.tools.volume_preprocessing import IMG_SIZE, resize_stack
+
+logger = logging.getLogger(__name__)
+
+TENSOR_STORE_ENABLED = os.getenv("TENSOR_STORE", "1") == "1"
+TENSOR_STORE_DIR     = os.getenv("TENSOR_STORE_DIR", "data/tensors")
+TENSOR_STORE_MAX_OPEN = int(os.getenv("TENSOR_STORE_MAX_OPEN", "32"))
+
+
+class TensorStore:
+    def __init__(self, root: str = TENSOR_STORE_DIR, enabled: bool = TENSOR_STORE_ENABLED,
+                 size: int = IMG_SIZE, max_open: int = TENSOR_STORE_MAX_OPEN):
+        self.root    = root
+        self.enabled = enabled
+        self.size    = size
+        self._lock   = threading.Lock()
+        self._build_locks = {}
+        self._open   = OrderedDict()  # nombre -> (firma de origen, memmap), orden LRU
+        self.max_open = max_open
+        self.builds  = 0
+        self.reads   = 0
+
+    def _name(self, flair_path):
+        digest = hashlib.sha1(os.path.abspath(flair_path).encode()).hexdigest()[:8]
+        return f"{scan_id_from_path(flair_path)}-{digest}"
+
+    @staticmethod
+    def _source(flair_path, t1ce_path):
+        return [list(file_signature(flair_path)), list(file_signature(t1ce_path))]
+
+    def _is_fresh(self, meta_path, source):
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                return json.load(f).get("source") == source
+        except (OSError, ValueError):
+            return False
+
+    def build(self, flair_path: str, t1ce_path: str, name: str = None, source=None):
+        """Redimensiona y normaliza el par completo y lo escribe de forma atómica."""
+        name = name or self._name(flair_path)
+        source = source or self._source(flair_path, t1ce_path)
+        flair = read_slab(flair_path, cache=False)
+        t1ce  = read_slab(t1ce_path, cache=False)
+        depth = min(flair.shape[2], t1ce.shape[2])
+
+        T = np.empty((depth, self.size, self.size, 2), dtype=np.float32)
+        resize_stack(flair[:, :, :depth], self.size, out=T[..., 0])
+        resize_stack(t1ce[:, :, :depth], self.size, out=T[..., 1])
+        peak = float(T.max())
+        if peak > 0:
+            T /= peak
+
+        os.makedirs(self.root, exist_ok=True)
+        npy_path, meta_path = self._paths(name)
+        tmp = f"{npy_path}.{os.getpid()}.tmp.npy"
+        np.save(tmp, T.astype(np.float16))
+        os.replace(tmp, npy_path)
+        with open(f"{meta_path}.tmp", "w", encoding="utf-8") as f:
+            json.dump({"source": source, "shape": list(T.shape), "scale": peak}, f)
+        os.replace(f"{meta_path}.tmp", meta_path)
+        with self._lock:
+            self.builds += 1
+        logger.info(f"Tensor store: built {name} {T.shape}")
+
+    def _paths(self, name):
+        base = os.path.join(self.root, name)
+        return f"{base}.npy", f"{base}.json"
+
+    def get(self, flair_path: str, t1ce_path: str):
+        """Tensor (profundidad, 128, 128, 2) float16 en memmap, reconstruido si el origen cambió."""
+        name = self._name(flair_path)
+        source = self._source(flair_path, t1ce_path)
+        with self._lock:
+            opened = self._open.get(name)
+            if opened is not None and opened[0] == source:
+                self._open.move_to_end(name)
+                self.reads += 1
+                return opened[1]
+            build_lock = self._build_locks.setdefault(name, threading.Lock())
+
+        with build_lock:
+            npy_path, meta_path = self._paths(name)
+            if not (os.path.exists(npy_path) and self._is_fresh(meta_path, source)):
+                self.build(flair_path, t1ce_path, name, source)
+            T = np.load(npy_path, mmap_mode="r")
+        with self._lock:
+            self._open.pop(name, None)
+            self._open[name] = (source, T)
+            while len(self._open) > max(1, self.max_open):
+                self._open.popitem(last=False)
+            self.reads += 1
+        return T
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"enabled": self.enabled, "open": len(self._open),
+                    "builds": self.builds, "reads": self.reads}
+
+
+TENSOR_STORE = TensorStore()
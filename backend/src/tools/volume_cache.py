@@ -0,0 +1,105 @@
+"""
+volume_cache.py
+Caché de volúmenes en memoria compartida por todo el proceso.
+
+Clasificador, segmentador y renderer leen los mismos `.nii` en una misma
+ejecución del flujo. Los bloques de slices ya decodificados (float32) se
+guardan aquí, identificados por (ruta absoluta, mtime, tamaño) y rango axial
+[start, stop); una petición cubierta por un bloque ya cargado se sirve como
+vista sin volver a leer el fichero.
+
+Los arrays devueltos son de solo lectura: se comparten entre llamantes.
+"""
+
+import os
+import threading
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+VOLUME_CACHE_BUDGET = int(os.getenv("VOLUME_CACHE_MB", "1024")) * 1024 * 1024
+
+
+def file_signature(path: str):
+    st = os.stat(path)
+    return os.path.abspath(path), st.st_mtime_ns, st.st_size
+
+
+class VolumeCache:
+    """LRU por bytes de bloques (H, W, n) float32."""
+
+    def __init__(self, budget_bytes: int = VOLUME_CACHE_BUDGET):
+        self.budget    = budget_bytes
+        self._lock     = threading.Lock()
+        self._entries  = OrderedDict()  # (firma, start, stop) -> array
+        self._bytes    = 0
+        self.hits      = 0
+        self.misses    = 0
+        self.evictions = 0
+
+    def _drop(self, key):
+        self._bytes -= self._entries.pop(key).nbytes
+
+    def lookup(self, path: str, start: int, stop: int):
+        """Vista [start, stop) desde un bloque que la cubra, o None."""
+        sig = file_signature(path)
+        with self._lock:
+            for key in reversed(self._entries):
+                k_sig, k_start, k_stop = key
+                if k_sig == sig and k_start <= start and stop <= k_stop:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return self._entries[key][:, :, start - k_start:stop - k_start]
+            self.misses += 1
+        return None
+
+    def insert(self, path: str, start: int, stop: int, array):
+        """Guarda un bloque recién leído (y descarta versiones antiguas o bloques que contiene)."""
+        sig = file_signature(path)
+        array.flags.writeable = False
+        if array.nbytes > self.budget:
+            return array
+        with self._lock:
+            for key in list(self._entries):
+                k_sig, k_start, k_stop = key
+                stale = k_sig[0] == sig[0] and k_sig != sig
+                contained = k_sig == sig and start <= k_start and k_stop <= stop
+                if stale or contained:
+                    self._drop(key)
+            self._entries[(sig, start, stop)] = array
+            self._bytes += array.nbytes
+            while self._bytes > self.budget:
+                key = next(iter(self._entries))
+                self._drop(key)
+                self.evictions += 1
+                logger.info(f"Volume cache evicted {os.path.basename(key[0][0])} [{key[1]}:{key[2]})")
+        return array
+
+    def get(self, path: str, start: int, stop: int, loader):
+        """Bloque [start, stop) desde la caché o leyéndolo con `loader(start, stop)`."""
+        view = self.lookup(path, start, stop)
+        if view is not None:
+            return view
+        return self.insert(path, start, stop, loader(start, stop))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "budget_bytes": self.budget,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+            }
+
+
+VOLUME_CACHE = VolumeCache()
@@ -0,0 +1,130 @@
+"""
+volume_preprocessing.py
+Pre-proceso vectorizado en float32 compartido por clasificador y segmentador.
+
+`cv2.resize` admite muchos canales por llamada (512 en OpenCV 4, 128 en
+OpenCV 5), así que un bloque (H, W, N) de slices axiales se redimensiona en
+trozos de 128 en lugar de con un bucle por slice.
+La salida se escribe directamente en el tensor final (una única reserva) y la
+normalización se hace in situ.
+"""
+
+import cv2
+import numpy as np
+
+IMG_SIZE        = 128
+VOLUME_SLICES   = 100
+VOLUME_START_AT = 22
+CV_MAX_CHANNELS = 128  # límite de canales por Mat en OpenCV 5 (512 en OpenCV 4)
+
+
+def resize_stack(stack, size: int = IMG_SIZE, out=None):
+    """
+    Redimensiona un bloque de slices (H, W, N) → (N, size, size) float32.
+
+    Args:
+        stack: Array (H, W, N) con los slices en el último eje.
+        size: Lado de salida.
+        out: Array destino (N, size, size) opcional; puede ser una vista.
+    """
+    h, w, n = stack.shape
+    if out is None:
+        out = np.empty((n, size, size), dtype=np.float32)
+    for a in range(0, n, CV_MAX_CHANNELS):
+        b = min(n, a + CV_MAX_CHANNELS)
+        src = np.ascontiguousarray(stack[:, :, a:b], dtype=np.float32)
+        resized = cv2.resize(src, (size, size), interpolation=cv2.INTER_LINEAR)
+        if resized.ndim == 2:  # OpenCV elimina el eje de canales cuando es 1
+            resized = resized[:, :, None]
+        out[a:b] = resized.transpose(2, 0, 1)
+    return out
+
+
+def preprocess_volume(flair, t1ce, start: int = VOLUME_START_AT, n_slices: int = VOLUME_SLICES,
+                      size: int = IMG_SIZE):
+    """
+    Entrada de la U-Net: (n_slices, size, size, 2) float32 normalizado por el
+    máximo global de ambos canales, igual que `X / np.max(X)`.
+    """
+    X = np.empty((n_slices, size, size, 2), dtype=np.float32)
+    resize_stack(flair[:, :, start:start + n_slices], size, out=X[..., 0])
+    resize_stack(t1ce[:, :, start:start + n_slices], size, out=X[..., 1])
+    peak = X.max()
+    if peak > 0:
+        X /= peak
+    return X
+
+
+def preprocess_slices(flair, t1ce, indices, size: int = IMG_SIZE):
+    """
+    Entrada del clasificador: (N, 2, size, size) float32 con cada slice y canal
+    normalizado a 0-1 por su propio máximo. Si t1ce es None se duplica FLAIR.
+    """
+    indices = list(indices)
+    x = np.empty((len(indices), 2, size, size), dtype=np.float32)
+    resize_stack(flair[:, :, indices], size, out=x[:, 0])
+    if t1ce is None:
+        x[:, 1] = x[:, 0]
+    else:
+        resize_stack(t1ce[:, :, indices], size, out=x[:, 1])
+    peak = x.max(axis=(2, 3), keepdims=True)
+    peak[peak == 0] = 1.0
+    x /= peak
+    return x
+
+
+# ——— Región de interés (ROI) ———
+ROI_THRESHOLD  = 0.05  # intensidad FLAIR mínima (sobre el volumen ya normalizado a 0-1)
+ROI_MIN_PIXELS = 50    # píxeles por encima del umbral para considerar que un slice tiene cerebro
+ROI_MARGIN     = 4     # margen en píxeles alrededor de la caja
+ROI_ALIGN      = 16    # la U-Net hace 4 poolings → lados múltiplos de 16
+
+
+def _aligned_range(lo, hi, size, margin, align):
+    lo, hi = max(0, lo - margin), min(size, hi + margin)
+    length = min(size, -(-(hi - lo) // align) * align)
+    hi = lo + length
+    if hi > size:
+        lo, hi = size - length, size
+    return int(lo), int(hi)
+
+
+def find_brain_roi(X, threshold: float = ROI_THRESHOLD, min_pixels: int = ROI_MIN_PIXELS,
+                   margin: int = ROI_MARGIN, align: int = ROI_ALIGN):
+    """
+    Localiza con un umbral de intensidad sobre el canal FLAIR de X
+    (N, size, size, 2) los slices con cerebro y su caja englobante en el plano.
+
+    Returns:
+        (slices, (r0, r1, c0, c1)) o None si no hay ningún slice con cerebro.
+    """
+    mask = X[..., 0] > threshold
+    slices = np.flatnonzero(mask.sum(axis=(1, 2)) >= min_pixels)
+    if slices.size == 0:
+        return None
+    in_plane = mask[slices].any(axis=0)
+    rows = np.flatnonzero(in_plane.any(axis=1))
+    cols = np.flatnonzero(in_plane.any(axis=0))
+    size_r, size_c = in_plane.shape
+    r0, r1 = _aligned_range(rows[0], rows[-1] + 1, size_r, margin, align)
+    c0, c1 = _aligned_range(cols[0], cols[-1] + 1, size_c, margin, align)
+    return slices, (r0, r1, c0, c1)
+
+
+# ——— Entradas a partir de un tensor ya redimensionado (N, size, size, 2) ———
+def window_from_tensor(T, start: int = VOLUME_START_AT, n_slices: int = VOLUME_SLICES):
+    """Ventana de la U-Net normalizada por su máximo global, como `preprocess_volume`."""
+    X = np.array(T[start:start + n_slices], dtype=np.float32)
+    peak = X.max()
+    if peak > 0:
+        X /= peak
+    return X
+
+
+def slices_from_tensor(T, indices):
+    """Entrada del clasificador (N, 2, size, size) normalizada por slice y canal, como `preprocess_slices`."""
+    x = np.ascontiguousarray(np.asarray(T[list(indices)], dtype=np.float32).transpose(0, 3, 1, 2))
+    peak = x.max(axis=(2, 3), keepdims=True)
+    peak[peak == 0] = 1.0
+    x /= peak
+    return x
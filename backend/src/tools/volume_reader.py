@@ -0,0 +1,234 @@
+"""
+volume_reader.py
+Lectura parcial de volúmenes NIfTI.
+
+`nib.load(path).get_fdata()` decodifica el volumen entero en float64 aunque
+el clasificador use un slice y el segmentador 100. Aquí los `.nii` sin
+comprimir se abren con memmap y solo se leen los slices axiales pedidos
+mediante `img.dataobj[..., a:b]`, convertidos a float32 (se aplican
+scl_slope/scl_inter igual que en get_fdata).
+
+Los `.nii.gz` se abren con indexed_gzip: el primer acceso construye un índice
+de puntos de acceso (persistido en GZ_INDEX_DIR) y las lecturas posteriores de
+un rango de slices solo descomprimen desde el punto más cercano. Los handles
+abiertos (descriptor + índice en memoria) se guardan en un LRU de
+GZ_MAX_HANDLES entradas que cierra el handle expulsado.
+
+Los bloques leídos se comparten entre clasificador, segmentador y renderer a
+través de VOLUME_CACHE (ver volume_cache.py).
+"""
+
+import os
+import hashlib
+import threading
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import numpy as np
+import nibabel as nib
+
+from src.tools.volume_cache import VOLUME_CACHE, file_signature
+
+try:
+    import indexed_gzip as igzip
+except ImportError:  # sin indexed_gzip, nibabel descomprime el .nii.gz de forma secuencial
+    igzip = None
+
+logger = logging.getLogger(__name__)
+
+NIFTI_SUFFIXES   = (".nii.gz", ".nii")
+PLANE_AXES       = {"sagittal": 0, "coronal": 1, "axial": 2}
+GZ_INDEX_DIR     = os.getenv("NIFTI_GZ_INDEX_DIR", "data/cache/gzindex")
+GZ_INDEX_SPACING = 1024 * 1024  # bytes descomprimidos entre puntos de acceso
+GZ_MAX_HANDLES   = int(os.getenv("NIFTI_GZ_MAX_HANDLES", "16"))
+
+_gz_lock    = threading.Lock()
+_gz_handles = OrderedDict()  # firma del fichero -> (IndexedGzipFile, lock), orden LRU
+
+
+@dataclass(frozen=True)
+class VolumeInfo:
+    """Metadatos de cabecera de un volumen."""
+    shape: tuple
+    spacing: tuple          # tamaño de vóxel en mm (x, y, z)
+    affine: np.ndarray      # matriz 4x4 vóxel → mundo
+    dtype: np.dtype         # tipo almacenado en disco
+
+    @property
+    def voxel_volume_mm3(self) -> float:
+        return float(np.prod(self.spacing))
+
+
+def scan_id_from_path(path: str) -> str:
+    """`data/pictures/carlos_perez_1_flair.nii(.gz)` → `carlos_perez_1`."""
+    name = os.path.basename(path)
+    for suffix in NIFTI_SUFFIXES:
+        if name.lower().endswith(suffix):
+            name = name[: -len(suffix)]
+            break
+    for modality in ("_flair", "_t1ce"):
+        if name.lower().endswith(modality):
+            return name[: -len(modality)]
+    return name
+
+
+# ——— Acceso aleatorio a .nii.gz ———
+def _gz_index_path(sig):
+    digest = hashlib.sha1(f"{sig[0]}:{sig[1]}:{sig[2]}".encode()).hexdigest()
+    return os.path.join(GZ_INDEX_DIR, f"{digest}.gzidx")
+
+
+def _close_handle(entry):
+    handle, lock = entry
+    with lock:  # espera a la lectura en curso, si la hay
+        handle.close()
+
+
+def _gz_handle(path):
+    """
+    IndexedGzipFile abierto (uno por fichero y versión) y su lock de lectura.
+    El índice de puntos de acceso se construye en el primer acceso y se guarda
+    en GZ_INDEX_DIR, de modo que en siguientes procesos solo se importa.
+    """
+    sig = file_signature(path)
+    with _gz_lock:
+        entry = _gz_handles.get(sig)
+        if entry is not None:
+            _gz_handles.move_to_end(sig)
+            return entry
+        for stale in [k for k in _gz_handles if k[0] == sig[0]]:
+            _close_handle(_gz_handles.pop(stale))
+        while len(_gz_handles) >= max(1, GZ_MAX_HANDLES):
+            _close_handle(_gz_handles.popitem(last=False)[1])
+
+        handle = igzip.IndexedGzipFile(path, spacing=GZ_INDEX_SPACING)
+        index_path = _gz_index_path(sig)
+        if os.path.exists(index_path):
+            handle.import_index(index_path)
+        else:
+            handle.build_full_index()
+            os.makedirs(GZ_INDEX_DIR, exist_ok=True)
+            tmp = f"{index_path}.{os.getpid()}.tmp"
+            handle.export_index(tmp)
+            os.replace(tmp, index_path)
+            logger.info(f"Built gzip seek index for {os.path.basename(path)}")
+        entry = _gz_handles[sig] = (handle, threading.Lock())
+        return entry
+
+
+def _is_gz(path):
+    return path.lower().endswith(".gz") and igzip is not None
+
+
+def _read(img, slicer):
+    """Lee `img.dataobj[slicer]`; en .nii.gz serializa el acceso al handle compartido."""
+    if getattr(img, "_gz_lock", None) is None:
+        return np.asarray(img.dataobj[slicer], dtype=np.float32)
+    while True:
+        with img._gz_lock:
+            if not img._gz_handle.closed:
+                return np.asarray(img.dataobj[slicer], dtype=np.float32)
+        # el handle salió del LRU mientras se usaba la imagen: se reabre
+        img = open_image(img.get_filename())
+
+
+def open_image(path: str):
+    """
+    Abre la imagen sin leer datos: los `.nii` sin comprimir quedan en memmap y
+    los `.nii.gz` se leen con indexed_gzip (si está instalado) a través de su
+    índice de acceso aleatorio.
+    """
+    if not _is_gz(path):
+        return nib.load(path, mmap=True)
+    handle, lock = _gz_handle(path)
+    with lock:
+        holder = nib.FileHolder(filename=path, fileobj=handle)
+        img = nib.Nifti1Image.from_file_map({"image": holder, "header": holder})
+    img._gz_handle, img._gz_lock = handle, lock
+    return img
+
+
+def volume_info(path: str, img=None) -> VolumeInfo:
+    img = img if img is not None else open_image(path)
+    header = img.header
+    return VolumeInfo(
+        shape=tuple(int(d) for d in img.shape),
+        spacing=tuple(float(z) for z in header.get_zooms()[:3]),
+        affine=np.asarray(img.affine),
+        dtype=header.get_data_dtype(),
+    )
+
+
+def _load_slab(path, start, stop, img=None):
+    img = img if img is not None else open_image(path)
+    depth = img.shape[2]
+    stop = depth if stop is None else min(stop, depth)
+    return _read(img, np.s_[:, :, start:stop])
+
+
+def read_slab(path: str, start: int = 0, stop: int = None, img=None, cache: bool = True) -> np.ndarray:
+    """
+    Slices axiales [start, stop) como (H, W, stop-start) float32. Con `cache`
+    el bloque se comparte vía VOLUME_CACHE (array de solo lectura).
+    """
+    if not cache:
+        return _load_slab(path, start, stop, img)
+    if stop is None:
+        img = img if img is not None else open_image(path)
+        stop = img.shape[2]
+    view = VOLUME_CACHE.lookup(path, start, stop)
+    if view is not None:
+        return view
+    slab = _load_slab(path, start, stop, img)
+    return VOLUME_CACHE.insert(path, start, start + slab.shape[2], slab)
+
+
+def read_slice(path: str, index: int, img=None, cache: bool = True) -> np.ndarray:
+    """Un único slice axial (H, W) float32."""
+    return read_slab(path, index, index + 1, img, cache)[:, :, 0]
+
+
+def read_slices(path: str, indices, img=None, cache: bool = True, span=None) -> np.ndarray:
+    """
+    Slices axiales `indices` como (H, W, len(indices)) float32.
+
+    Con `cache` se lee (o se reutiliza) el rango contiguo `span` = (start, stop)
+    que los cubre (por defecto el mínimo); pasar la ventana completa permite
+    compartir el bloque con el segmentador. Sin caché, si los índices son
+    equiespaciados se leen con un slice con paso.
+    """
+    indices = [int(k) for k in indices]
+    start, stop = min(indices), max(indices) + 1
+    if span is not None:
+        start, stop = min(start, span[0]), max(stop, span[1])
+    if cache:
+        slab = read_slab(path, start, stop, img)
+        return slab[:, :, [k - start for k in indices]]
+
+    img = img if img is not None else open_image(path)
+    steps = {b - a for a, b in zip(indices, indices[1:])}
+    if len(steps) <= 1 and (not steps or steps.pop() > 0):
+        step = indices[1] - indices[0] if len(indices) > 1 else 1
+        return _read(img, np.s_[:, :, indices[0]:indices[-1] + 1:step])
+    slab = _load_slab(path, start, stop, img)
+    return slab[:, :, [k - start for k in indices]]
+
+
+def read_plane(path: str, plane: str, index: int, img=None) -> np.ndarray:
+    """
+    Un plano 2-D float32: axial (H, W), coronal (H, D) o sagital (W, D).
+    Los planos no axiales se sirven del volumen completo si ya está en
+    VOLUME_CACHE y, si no, se leen con un único slice de `dataobj` (memmap o
+    índice gzip) sin decodificar el resto del volumen.
+    """
+    axis = PLANE_AXES[plane]
+    img = img if img is not None else open_image(path)
+    if not 0 <= index < img.shape[axis]:
+        raise IndexError(f"{plane} index {index} out of range [0, {img.shape[axis]})")
+    if axis == 2:
+        return read_slice(path, index, img)
+    full = VOLUME_CACHE.lookup(path, 0, img.shape[2])
+    if full is not None:
+        return full[index] if axis == 0 else full[:, index]
+    return _read(img, np.s_[index, :, :] if axis == 0 else np.s_[:, index, :])